@@ -1,36 +1,57 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 from typing import Optional
-from app.database import get_db
+from app.database import get_async_db
 from app.models.user import User
 from app.schemas.auth import UserRegister, UserLogin, TokenResponse, UserResponse
-from app.utils.password import verify_password, get_password_hash
-from app.utils.jwt import create_access_token, get_current_user
+from app.utils.password import password_hasher, needs_rehash, PasswordHasherBusy
+from app.utils.jwt import create_access_token, get_current_user, CurrentUser
 from app.config import settings
 from datetime import timedelta
 
 router = APIRouter(prefix="/api/auth", tags=["认证"])
 
 
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="请求过多，请稍后重试"
+        )
+
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="登录请求过多，请稍后重试"
+        )
+
+
 @router.post("/register", response_model=dict, status_code=status.HTTP_201_CREATED)
-async def register(user_data: UserRegister, db: Session = Depends(get_db)):
+async def register(user_data: UserRegister, db: AsyncSession = Depends(get_async_db)):
     # 检查用户名是否已存在
-    if db.query(User).filter(User.username == user_data.username).first():
+    if await db.scalar(select(User).filter(User.username == user_data.username)):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="用户名已存在"
         )
     
     # 检查邮箱是否已存在
-    if db.query(User).filter(User.email == user_data.email).first():
+    if await db.scalar(select(User).filter(User.email == user_data.email)):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="邮箱已存在"
         )
     
     # 创建新用户
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await hash_password(user_data.password)
     user = User(
         username=user_data.username,
         email=user_data.email,
@@ -39,10 +60,10 @@ async def register(user_data: UserRegister, db: Session = Depends(get_db)):
     
     try:
         db.add(user)
-        db.commit()  # 因为关了自动commit，需要手动commit持久化
-        db.refresh(user)
+        await db.commit()  # 因为关了自动commit，需要手动commit持久化
+        await db.refresh(user)
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="注册失败，用户名或邮箱已存在"
@@ -60,15 +81,24 @@ async def register(user_data: UserRegister, db: Session = Depends(get_db)):
 
 
 @router.post("/login", response_model=dict)
-async def login(user_data: UserLogin, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == user_data.username).first()
+async def login(user_data: UserLogin, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).filter(User.username == user_data.username))
     
-    if not user or not verify_password(user_data.password, user.password_hash):
+    if not user or not await check_password(user_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="用户名或密码错误"
         )
     
+    if needs_rehash(user.password_hash):
+        # bcrypt 成本调整后，在用户登录（此时才有明文密码）时按新成本重新计算哈希
+        try:
+            user.password_hash = await password_hasher.hash(user_data.password)
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            print(f"重新计算密码哈希失败: {e}")
+    
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"user_id": user.id, "username": user.username},
@@ -92,7 +122,7 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
 
 
 @router.post("/refresh", response_model=dict)
-async def refresh_token(current_user: User = Depends(get_current_user)):
+async def refresh_token(current_user: CurrentUser = Depends(get_current_user)):
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"user_id": current_user.id, "username": current_user.username},
@@ -111,7 +141,7 @@ async def refresh_token(current_user: User = Depends(get_current_user)):
 
 
 @router.get("/me", response_model=dict)
-async def get_me(current_user: User = Depends(get_current_user)):
+async def get_me(current_user: CurrentUser = Depends(get_current_user)):
     return {
         "success": True,
         "data": {
@@ -128,10 +158,10 @@ async def get_me(current_user: User = Depends(get_current_user)):
 async def search_users(
     q: Optional[str] = Query(None, description="搜索关键词（用户名或ID）"),
     limit: int = Query(10, ge=1, le=50, description="返回数量"),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    query = db.query(User)
+    query = select(User)
     
     if q:
         try:
@@ -140,7 +170,7 @@ async def search_users(
         except ValueError:
             query = query.filter(User.username.ilike(f"%{q}%"))
     
-    users = query.limit(limit).all()
+    users = (await db.scalars(query.limit(limit))).all()
     
     users_list = [
         {
@@ -1,69 +1,65 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import Optional
-import os
-from app.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Header
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, Tuple
+from datetime import datetime
+import asyncio
+import base64
+import json
+from app.database import get_async_db
 from app.models.document import Document
 from app.models.document_operation import DocumentOperation
 from app.models.document_share import DocumentShare, PermissionType
 from app.models.user import User
 from app.schemas.document import DocumentCreate, DocumentUpdate, DocumentResponse, DocumentListResponse
-from app.schemas.operation import OperationRequest
+from app.schemas.operation import OperationRequest, OperationBatchRequest
 from app.schemas.share import DocumentShareCreate, DocumentShareResponse
-from app.utils.jwt import get_current_user
-from app.utils.operation import apply_operation
-from app.utils.permission import has_document_access, get_user_documents_query, get_user_permission
-from app.websocket.manager import manager
-from app.config import settings
+from app.utils.jwt import get_current_user_id
+from app.utils.permission import has_document_access, get_user_documents_query, get_user_permission, permission_cache, revoke_access
+from app.storage.cache import document_cache
+from app.storage.files import (
+    get_document_file_path,
+    write_document_content,
+    delete_document_content,
+    open_document_content,
+    find_line_range,
+    iter_content_range,
+    close_content,
+)
+from app.storage.write_behind import write_behind
+from app.storage.history import operation_history, document_at_version, catch_up
+from app.storage.snapshots import snapshot_policy, add_snapshot_async, orphaned_snapshot_blobs, delete_blobs
+from app.utils.editing import apply_operations, broadcast_records
 
 router = APIRouter(prefix="/api/documents", tags=["文档"])
 
 
-def ensure_documents_dir():
-    os.makedirs(settings.DOCUMENTS_DIR, exist_ok=True)
-
-
-def get_document_file_path(document_id: int) -> str:
-    return os.path.join(settings.DOCUMENTS_DIR, f"{document_id}.md")
-
-
-def read_document_content(document_id: int) -> str:
-    file_path = get_document_file_path(document_id)
-    if os.path.exists(file_path):
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
-    return ""
-
-
-def write_document_content(document_id: int, content: str):
-    ensure_documents_dir()
-    file_path = get_document_file_path(document_id)
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(content)
-
-
 @router.post("", response_model=dict, status_code=status.HTTP_201_CREATED)
 async def create_document(
     document_data: DocumentCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
 ):
     document = Document(
         title=document_data.title,
-        owner_id=current_user.id,
+        owner_id=current_user_id,
         content_path="",
         current_version=0
     )
     
     db.add(document)
-    db.commit()
-    db.refresh(document)
+    await db.commit()
+    await db.refresh(document)
     
     document.content_path = get_document_file_path(document.id)
-    db.commit()
+    # 快照 blob 与文档文件的写入在线程池中执行，不阻塞事件循环
+    await add_snapshot_async(db, document.id, document.current_version, document_data.content)
+    await db.commit()
+    await db.refresh(document)
     
-    write_document_content(document.id, document_data.content)
+    await asyncio.get_running_loop().run_in_executor(None, write_document_content, document.id, document_data.content)
+    document_cache.put(document.id, document_data.content, document.current_version)
     
     return {
         "success": True,
@@ -79,36 +75,80 @@ async def create_document(
     }
 
 
+def _comparable_timestamp(db: AsyncSession, value):
+    # SQLite 没有时间类型，server_default 写入的 "YYYY-MM-DD HH:MM:SS" 与绑定参数的 "YYYY-MM-DD HH:MM:SS.ffffff"
+    # 按文本比较时相等的时间也会判为不等，列与游标两边都经 strftime 规范成同一格式后再比较和排序
+    if db.bind.dialect.name == "sqlite":
+        return func.strftime("%Y-%m-%d %H:%M:%f", value)
+    return value
+
+
+def _encode_cursor(document: Document) -> str:
+    raw = json.dumps([document.updated_at.isoformat(), document.id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        updated_at, document_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(updated_at), int(document_id)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="无效的分页游标"
+        )
+
+
 @router.get("", response_model=dict)
 async def get_documents(
-    page: int = Query(1, ge=1, description="页码"),
+    page: int = Query(1, ge=1, description="页码（未提供 cursor 时按页码分页）"),
     page_size: int = Query(20, ge=1, le=100, description="每页数量"),
     search: Optional[str] = Query(None, description="搜索关键词"),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor，按 (updated_at, id) 继续分页"),
+    include_total: bool = Query(True, description="是否统计总数，为 false 时 total 与 total_pages 为 null"),
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    query = get_user_documents_query(db, current_user.id)
+    # 文档与当前用户的权限在同一个查询中取得；使用 cursor 时按 (updated_at, id) 做键集分页，翻页深度不影响耗时
+    query = get_user_documents_query(current_user_id)
     
     if search:
         query = query.filter(Document.title.ilike(f"%{search}%"))
     
-    total = query.count()
-    
-    offset = (page - 1) * page_size
-    documents = query.order_by(Document.updated_at.desc()).offset(offset).limit(page_size).all()
-    
-    total_pages = (total + page_size - 1) // page_size
+    total = None
+    total_pages = None
+    if include_total:
+        total = await db.scalar(select(func.count()).select_from(query.subquery()))
+        total_pages = (total + page_size - 1) // page_size
+    
+    updated_at_key = _comparable_timestamp(db, Document.updated_at)
+    if cursor:
+        updated_at, last_id = _decode_cursor(cursor)
+        cursor_key = _comparable_timestamp(db, updated_at)
+        query = query.filter(or_(
+            updated_at_key < cursor_key,
+            and_(updated_at_key == cursor_key, Document.id < last_id)
+        ))
+    else:
+        query = query.offset((page - 1) * page_size)
+    
+    # 多取一行用于判断是否还有下一页
+    rows = (await db.execute(
+        query.order_by(updated_at_key.desc(), Document.id.desc()).limit(page_size + 1)
+    )).all()
+    next_cursor = _encode_cursor(rows[page_size - 1].Document) if len(rows) > page_size else None
     
     items = []
-    for doc in documents:
-        permission = get_user_permission(db, doc.id, current_user.id)
+    for doc, share_permission in rows[:page_size]:
+        is_owner = doc.owner_id == current_user_id
+        permission = PermissionType.ADMIN if is_owner else share_permission
         items.append({
             "id": doc.id,
             "title": doc.title,
             "owner_id": doc.owner_id,
-            "is_owner": doc.owner_id == current_user.id,
+            "is_owner": is_owner,
             "permission": permission.value,
-            "current_version": doc.current_version,
+            "current_version": document_cache.version_of(doc.id, doc.current_version),
             "created_at": doc.created_at.isoformat(),
             "updated_at": doc.updated_at.isoformat()
         })
@@ -120,7 +160,8 @@ async def get_documents(
             "total": total,
             "page": page,
             "page_size": page_size,
-            "total_pages": total_pages
+            "total_pages": total_pages,
+            "next_cursor": next_cursor
         },
         "message": "获取成功"
     }
@@ -129,16 +170,17 @@ async def get_documents(
 @router.get("/{document_id}", response_model=dict)
 async def get_document(
     document_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    include_content: bool = Query(True, description="是否返回文档内容，为 false 时只返回元数据"),
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    if not has_document_access(db, document_id, current_user.id, PermissionType.READ):
+    if not await has_document_access(db, document_id, current_user_id, PermissionType.READ):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="文档不存在或无权访问"
         )
     
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = await db.scalar(select(Document).filter(Document.id == document_id))
     
     if not document:
         raise HTTPException(
@@ -146,20 +188,154 @@ async def get_document(
             detail="文档不存在"
         )
     
-    content = read_document_content(document.id)
-    user_permission = get_user_permission(db, document_id, current_user.id)
+    user_permission = await get_user_permission(db, document_id, current_user_id)
+    data = {
+        "id": document.id,
+        "title": document.title,
+        "owner_id": document.owner_id,
+        "current_version": document_cache.version_of(document.id, document.current_version),
+        "permission": user_permission.value,
+        "created_at": document.created_at.isoformat(),
+        "updated_at": document.updated_at.isoformat()
+    }
+    
+    if include_content:
+        cached = await document_cache.load(document.id, document.current_version)
+        data["content"] = cached.content
+        data["current_version"] = cached.version
+    
+    return {
+        "success": True,
+        "data": data,
+        "message": "获取成功"
+    }
+
+
+def _parse_byte_range(range_header: str, size: int) -> Tuple[int, int]:
+    # 只支持单个范围：bytes=start-end、bytes=start-、bytes=-suffix，返回 [start, end)
+    unit, _, spec = range_header.partition("=")
+    start_text, sep, end_text = spec.strip().partition("-")
+    if unit.strip() != "bytes" or not sep or "," in spec:
+        raise ValueError("不支持的 Range 格式")
+    if not start_text:
+        length = int(end_text)
+        if length <= 0:
+            raise ValueError("无效的 Range")
+        return max(size - length, 0), size
+    start = int(start_text)
+    end = int(end_text) + 1 if end_text else size
+    if start >= size or end <= start:
+        raise ValueError("Range 超出文档范围")
+    return start, min(end, size)
+
+
+@router.get("/{document_id}/content")
+async def get_document_content(
+    document_id: int,
+    from_line: Optional[int] = Query(None, ge=0, description="起始行（从 0 开始）"),
+    to_line: Optional[int] = Query(None, ge=0, description="结束行（不包含）"),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # 流式返回文档内容（UTF-8 字节），支持 HTTP Range 字节范围或按行读取，大文件通过内存映射读取
+    if not await has_document_access(db, document_id, current_user_id, PermissionType.READ):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="文档不存在或无权访问"
+        )
+    
+    document = await db.scalar(select(Document).filter(Document.id == document_id))
+    
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="文档不存在"
+        )
+    
+    cached = document_cache.get(document.id)
+    if cached is not None and cached.dirty:
+        # 写回模式下文件可能落后于缓存
+        content = cached.content.encode("utf-8")
+        version = cached.version
+    else:
+        content = open_document_content(document.id)
+        version = document.current_version
+    
+    size = len(content)
+    status_code = status.HTTP_200_OK
+    headers = {"Accept-Ranges": "bytes", "X-Document-Version": str(version)}
+    if from_line is not None or to_line is not None:
+        start, end = find_line_range(content, from_line or 0, to_line)
+    elif range_header:
+        try:
+            start, end = _parse_byte_range(range_header, size)
+        except ValueError as e:
+            close_content(content)
+            raise HTTPException(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                detail=str(e),
+                headers={"Content-Range": f"bytes */{size}"}
+            )
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    else:
+        start, end = 0, size
+    headers["Content-Length"] = str(end - start)
+    
+    return StreamingResponse(
+        iter_content_range(content, start, end),
+        status_code=status_code,
+        media_type="text/markdown; charset=utf-8",
+        headers=headers
+    )
+
+
+@router.get("/{document_id}/versions/{version}", response_model=dict)
+async def get_document_version(
+    document_id: int,
+    version: int,
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if not await has_document_access(db, document_id, current_user_id, PermissionType.READ):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="文档不存在或无权访问"
+        )
+    
+    document = await db.scalar(select(Document).filter(Document.id == document_id))
+    
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="文档不存在"
+        )
+    
+    cached = await document_cache.load(document.id, document.current_version)
+    if version < 0 or version > cached.version:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"版本 {version} 不存在，当前版本是 {cached.version}"
+        )
+    
+    if version == cached.version:
+        content = cached.content
+    else:
+        content = await db.run_sync(lambda session: document_at_version(session, document.id, version))
+        if content is None:
+            raise HTTPException(
+                status_code=status.HTTP_410_GONE,
+                detail=f"版本 {version} 的历史记录已被合并或不可用"
+            )
     
     return {
         "success": True,
         "data": {
             "id": document.id,
-            "title": document.title,
-            "owner_id": document.owner_id,
+            "version": version,
             "content": content,
-            "current_version": document.current_version,
-            "permission": user_permission.value,
-            "created_at": document.created_at.isoformat(),
-            "updated_at": document.updated_at.isoformat()
+            "current_version": cached.version
         },
         "message": "获取成功"
     }
@@ -169,10 +345,10 @@ async def get_document(
 async def update_document(
     document_id: int,
     document_data: DocumentUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = await db.scalar(select(Document).filter(Document.id == document_id))
     
     if not document:
         raise HTTPException(
@@ -180,7 +356,7 @@ async def update_document(
             detail="文档不存在"
         )
     
-    if document.owner_id != current_user.id:
+    if document.owner_id != current_user_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="只有文档所有者可以修改标题"
@@ -189,8 +365,8 @@ async def update_document(
     if document_data.title is not None:
         document.title = document_data.title
     
-    db.commit()
-    db.refresh(document)
+    await db.commit()
+    await db.refresh(document)
     
     return {
         "success": True,
@@ -206,10 +382,10 @@ async def update_document(
 @router.delete("/{document_id}", response_model=dict)
 async def delete_document(
     document_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = await db.scalar(select(Document).filter(Document.id == document_id))
     
     if not document:
         raise HTTPException(
@@ -217,18 +393,23 @@ async def delete_document(
             detail="文档不存在"
         )
     
-    if document.owner_id != current_user.id:
+    if document.owner_id != current_user_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="只有文档所有者可以删除文档"
         )
     
-    file_path = get_document_file_path(document.id)
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    write_behind.discard(document.id)
+    operation_history.discard(document.id)
+    snapshot_policy.discard(document.id)
+    delete_document_content(document.id)
+    document_cache.invalidate(document.id)
     
-    db.delete(document)
-    db.commit()
+    orphaned_blobs = await db.run_sync(lambda session: orphaned_snapshot_blobs(session, document.id))
+    await db.delete(document)
+    await db.commit()
+    revoke_access(document.id)
+    await asyncio.get_running_loop().run_in_executor(None, delete_blobs, orphaned_blobs)
     
     return {
         "success": True,
@@ -239,16 +420,16 @@ async def delete_document(
 @router.get("/{document_id}/editors", response_model=dict)
 async def get_document_editors(
     document_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    if not has_document_access(db, document_id, current_user.id, PermissionType.READ):
+    if not await has_document_access(db, document_id, current_user_id, PermissionType.READ):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="文档不存在或无权访问"
         )
     
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = await db.scalar(select(Document).filter(Document.id == document_id))
     
     if not document:
         raise HTTPException(
@@ -256,7 +437,7 @@ async def get_document_editors(
             detail="文档不存在"
         )
     
-    editors_query = db.query(
+    editors_query = select(
         DocumentOperation.user_id,
         User.username,
         User.color,
@@ -271,7 +452,7 @@ async def get_document_editors(
         func.max(DocumentOperation.timestamp).desc()
     )
     
-    editors = editors_query.all()
+    editors = (await db.execute(editors_query)).all()
     
     editors_list = [
         {
@@ -293,20 +474,20 @@ async def get_document_editors(
     }
 
 
-@router.post("/{document_id}/operations", response_model=dict)
-async def apply_document_operation(
+@router.get("/{document_id}/operations", response_model=dict)
+async def get_document_operations(
     document_id: int,
-    operation: OperationRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    since: int = Query(..., ge=0, description="客户端当前的版本号"),
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    if not has_document_access(db, document_id, current_user.id, PermissionType.EDIT):
+    if not await has_document_access(db, document_id, current_user_id, PermissionType.READ):
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="无权编辑此文档"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="文档不存在或无权访问"
         )
     
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = await db.scalar(select(Document).filter(Document.id == document_id))
     
     if not document:
         raise HTTPException(
@@ -314,67 +495,104 @@ async def apply_document_operation(
             detail="文档不存在"
         )
     
-    # 这里先使用一种很暴力的办法来判断（当前还是只支持单用户编辑的，在支持多用户时，这里就有相应的冲突解决措施）
-    if operation.base_version != document.current_version:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail=f"版本冲突：操作基于版本 {operation.base_version}，但当前版本是 {document.current_version}"
-        )
-    
-    content = read_document_content(document.id)
-    
+    cached = await document_cache.load(document.id, document.current_version)
     try:
-        operation_dict = operation.model_dump()
-        new_content = apply_operation(content, operation_dict)
+        data = await db.run_sync(lambda session: catch_up(session, document, cached, since))
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"操作应用失败: {str(e)}"
+            detail=str(e)
         )
     
-    version_before = document.current_version
-    version_after = version_before + 1
+    return {
+        "success": True,
+        "data": data,
+        "message": "获取成功"
+    }
+
+
+@router.post("/{document_id}/operations", response_model=dict)
+async def apply_document_operation(
+    document_id: int,
+    operation: OperationRequest,
+    x_connection_id: Optional[str] = Header(None),
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if not await has_document_access(db, document_id, current_user_id, PermissionType.EDIT):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="无权编辑此文档"
+        )
     
-    write_document_content(document.id, new_content)
+    document = await db.scalar(select(Document).filter(Document.id == document_id))
     
-    document.current_version = version_after
-    db.commit()
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="文档不存在"
+        )
     
-    operation_record = DocumentOperation(
-        document_id=document.id,
-        user_id=current_user.id,
-        operation_type=operation.type,
-        operation_data=operation.model_dump(),
-        sequence_number=version_after,
-        version_before=version_before,
-        version_after=version_after
+    records, version_after = await apply_operations(
+        db, document, current_user_id, operation.base_version, [operation.model_dump()]
     )
-    db.add(operation_record)
-    db.commit()
     
-    operation_data = operation.model_dump()
-    operation_data["version"] = version_after
+    # 通过 X-Connection-Id 标明发起请求的 WebSocket 连接，只有该连接不会收到这次广播
+    await broadcast_records(document_id, records, current_user_id, x_connection_id)
     
-    await manager.broadcast_to_document(
-        {
-            "type": "operation_applied",
-            "data": {
-                "document_id": document_id,
-                "operation": operation_data,
-                "version": version_after
-            }
+    return {
+        "success": True,
+        "data": {
+            "version": version_after,
+            "operation": operation.model_dump(),
+            "applied_operations": [
+                {**record["operation"], "version": record["version_after"]}
+                for record in records
+            ]
         },
-        document_id,
-        exclude_user_id=current_user.id
+        "message": "操作应用成功"
+    }
+
+
+@router.post("/{document_id}/operations:batch", response_model=dict)
+async def apply_document_operations_batch(
+    document_id: int,
+    batch: OperationBatchRequest,
+    x_connection_id: Optional[str] = Header(None),
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if not await has_document_access(db, document_id, current_user_id, PermissionType.EDIT):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="无权编辑此文档"
+        )
+    
+    document = await db.scalar(select(Document).filter(Document.id == document_id))
+    
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="文档不存在"
+        )
+    
+    records, version_after = await apply_operations(
+        db, document, current_user_id, batch.base_version, [operation.model_dump() for operation in batch.operations]
     )
     
+    await broadcast_records(document_id, records, current_user_id, x_connection_id)
+    
     return {
         "success": True,
         "data": {
+            "base_version": batch.base_version,
             "version": version_after,
-            "operation": operation.model_dump()
+            "operations": [
+                {**record["operation"], "version": record["version_after"]}
+                for record in records
+            ]
         },
-        "message": "操作应用成功"
+        "message": "批量操作应用成功"
     }
 
 
@@ -382,10 +600,10 @@ async def apply_document_operation(
 async def share_document(
     document_id: int,
     share_data: DocumentShareCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = await db.scalar(select(Document).filter(Document.id == document_id))
     
     if not document:
         raise HTTPException(
@@ -393,35 +611,36 @@ async def share_document(
             detail="文档不存在"
         )
     
-    if document.owner_id != current_user.id:
+    if document.owner_id != current_user_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="只有文档所有者可以分享文档"
         )
     
-    if share_data.user_id == current_user.id:
+    if share_data.user_id == current_user_id:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="不能分享给自己"
         )
     
-    target_user = db.query(User).filter(User.id == share_data.user_id).first()
+    target_user = await db.scalar(select(User).filter(User.id == share_data.user_id))
     if not target_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="目标用户不存在"
         )
     
-    existing_share = db.query(DocumentShare).filter(
+    existing_share = await db.scalar(select(DocumentShare).filter(
         DocumentShare.document_id == document_id,
         DocumentShare.user_id == share_data.user_id
-    ).first()
+    ))
     
     if existing_share:
         existing_share.permission = share_data.permission
-        existing_share.shared_by = current_user.id
-        db.commit()
-        db.refresh(existing_share)
+        existing_share.shared_by = current_user_id
+        await db.commit()
+        permission_cache.invalidate(document_id, share_data.user_id)
+        await db.refresh(existing_share)
         
         return {
             "success": True,
@@ -442,12 +661,13 @@ async def share_document(
         document_id=document_id,
         user_id=share_data.user_id,
         permission=share_data.permission,
-        shared_by=current_user.id
+        shared_by=current_user_id
     )
     
     db.add(new_share)
-    db.commit()
-    db.refresh(new_share)
+    await db.commit()
+    permission_cache.invalidate(document_id, share_data.user_id)
+    await db.refresh(new_share)
     
     return {
         "success": True,
@@ -468,10 +688,10 @@ async def share_document(
 @router.get("/{document_id}/shares", response_model=dict)
 async def get_document_shares(
     document_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = await db.scalar(select(Document).filter(Document.id == document_id))
     
     if not document:
         raise HTTPException(
@@ -479,17 +699,17 @@ async def get_document_shares(
             detail="文档不存在"
         )
     
-    if document.owner_id != current_user.id:
+    if document.owner_id != current_user_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="只有文档所有者可以查看分享列表"
         )
     
-    shares = db.query(DocumentShare, User).join(
+    shares = (await db.execute(select(DocumentShare, User).join(
         User, DocumentShare.user_id == User.id
     ).filter(
         DocumentShare.document_id == document_id
-    ).all()
+    ))).all()
     
     shares_list = [
         {
@@ -518,10 +738,10 @@ async def get_document_shares(
 async def unshare_document(
     document_id: int,
     share_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = await db.scalar(select(Document).filter(Document.id == document_id))
     
     if not document:
         raise HTTPException(
@@ -529,16 +749,16 @@ async def unshare_document(
             detail="文档不存在"
         )
     
-    if document.owner_id != current_user.id:
+    if document.owner_id != current_user_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="只有文档所有者可以取消分享"
         )
     
-    share = db.query(DocumentShare).filter(
+    share = await db.scalar(select(DocumentShare).filter(
         DocumentShare.id == share_id,
         DocumentShare.document_id == document_id
-    ).first()
+    ))
     
     if not share:
         raise HTTPException(
@@ -546,8 +766,9 @@ async def unshare_document(
             detail="分享记录不存在"
         )
     
-    db.delete(share)
-    db.commit()
+    await db.delete(share)
+    await db.commit()
+    revoke_access(document_id, share.user_id)
     
     return {
         "success": True,
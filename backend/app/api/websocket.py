@@ -1,18 +1,28 @@
+from typing import Optional
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, HTTPException, status
-from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal
 from app.models.document import Document
-from app.models.user import User
 from app.models.document_share import PermissionType
-from app.utils.jwt import verify_token
-from app.utils.permission import has_document_access
-from app.websocket.manager import manager
-import json
+from app.schemas.operation import OperationRequest
+from app.schemas.presence import CursorUpdate, PresenceUpdate
+from app.utils.jwt import verify_token, load_user, CurrentUser
+from app.utils.permission import has_document_access, get_user_permission, permission_cache
+from app.utils.editing import apply_operations, broadcast_records
+from pydantic import ValidationError
+from app.websocket.manager import manager, Connection
+from app.websocket.protocol import get_codec, receive_message
+from app.websocket.presence import presence_hub
+from app.websocket.heartbeat import heartbeat_scheduler
+from app.websocket.sync import initial_sync_cache
+from app.storage.cache import document_cache
+from app.storage.history import catch_up
 
 router = APIRouter()
 
 
-async def get_user_from_token(token: str, db: Session) -> User:
+async def get_user_from_token(token: str, db: AsyncSession) -> CurrentUser:
     payload = verify_token(token)
     if payload is None:
         raise HTTPException(
@@ -27,7 +37,7 @@ async def get_user_from_token(token: str, db: Session) -> User:
             detail="无效的认证令牌"
         )
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await load_user(db, user_id)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -37,76 +47,286 @@ async def get_user_from_token(token: str, db: Session) -> User:
     return user
 
 
+def is_document_id(value) -> bool:
+    # 消息中的 document_id 来自客户端，可能是任意 JSON 值；bool 是 int 的子类，需要单独排除
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def send_error(connection: Connection, message: str, document_id: Optional[int] = None):
+    data = {"message": message}
+    if document_id is not None:
+        data["document_id"] = document_id
+    connection.send({
+        "type": "error",
+        "data": data
+    })
+
+
+async def handle_operation(connection: Connection, document_id: int, message: dict):
+    # 与 REST 接口走同一套应用、持久化与广播流程，结果通过 operation_ack / operation_error 返回。
+    # 客户端可以附带 id 用于匹配应答
+    request_id = message.get("id")
+    user_id = connection.user_id
+    
+    def send_operation_error(status_code: int, detail: str):
+        connection.send({
+            "type": "operation_error",
+            "data": {
+                "id": request_id,
+                "document_id": document_id,
+                "status": status_code,
+                "message": detail
+            }
+        })
+    
+    try:
+        operation = OperationRequest.model_validate(message.get("data") or {})
+    except ValidationError as e:
+        send_operation_error(status.HTTP_422_UNPROCESSABLE_ENTITY, f"无效的操作: {e.errors()[0]['msg']}")
+        return
+    
+    # 只在应用操作期间占用数据库连接
+    async with AsyncSessionLocal() as db:
+        document = await db.scalar(select(Document).filter(Document.id == document_id))
+        if document is None:
+            send_operation_error(status.HTTP_404_NOT_FOUND, "文档不存在")
+            return
+        # 每条操作都重新检查权限（有缓存）：订阅之后被取消分享或降为只读的用户不能继续编辑
+        can_edit = await has_document_access(db, document_id, user_id, PermissionType.EDIT)
+        if document_id in connection.documents:
+            connection.documents[document_id] = can_edit
+        if not can_edit:
+            send_operation_error(status.HTTP_403_FORBIDDEN, "无权编辑此文档")
+            return
+        
+        try:
+            records, version_after = await apply_operations(
+                db, document, user_id, operation.base_version, [operation.model_dump()]
+            )
+        except HTTPException as e:
+            send_operation_error(e.status_code, e.detail)
+            return
+        except Exception as e:
+            await db.rollback()
+            print(f"WebSocket 操作应用失败: {e}")
+            send_operation_error(status.HTTP_500_INTERNAL_SERVER_ERROR, "操作应用失败")
+            return
+    
+    connection.send({
+        "type": "operation_ack",
+        "data": {
+            "id": request_id,
+            "document_id": document_id,
+            "version": version_after,
+            "applied_operations": [
+                {**record["operation"], "version": record["version_after"]}
+                for record in records
+            ]
+        }
+    })
+    await broadcast_records(document_id, records, exclude_connection_id=connection.connection_id)
+
+
+async def handle_catch_up(connection: Connection, document_id: int, message: dict):
+    since = (message.get("data") or {}).get("since")
+    if not isinstance(since, int) or since < 0:
+        send_error(connection, "catch_up 消息需要提供有效的 since 版本号", document_id)
+        return
+    
+    async with AsyncSessionLocal() as db:
+        document = await db.scalar(select(Document).filter(Document.id == document_id))
+        if document is None or not await has_document_access(db, document_id, connection.user_id, PermissionType.READ):
+            send_error(connection, "文档不存在或无权访问", document_id)
+            return
+        cached = await document_cache.load(document_id, document.current_version)
+        try:
+            data = await db.run_sync(lambda session: catch_up(session, document, cached, since))
+        except ValueError as e:
+            send_error(connection, str(e), document_id)
+            return
+    
+    connection.send({
+        "type": "caught_up",
+        "data": data
+    })
+
+
+async def handle_subscribe(connection: Connection, document_id, sync: bool = False):
+    # sync 为 true 时在 subscribed 之后发送 initial_sync，携带当前内容与版本，客户端无需再通过 REST 获取内容。
+    # 订阅先于读取内容生效，之后收到的 operation_applied 中版本不超过 initial_sync 版本的操作已包含在内容中
+    if not is_document_id(document_id):
+        send_error(connection, "subscribe 消息需要提供有效的 document_id")
+        return
+    
+    async with AsyncSessionLocal() as db:
+        document = await db.scalar(select(Document).filter(Document.id == document_id))
+        if not document or not await has_document_access(db, document_id, connection.user_id, PermissionType.READ):
+            send_error(connection, "文档不存在或无权访问", document_id)
+            return
+        stored_version = document.current_version
+        # 告知客户端是否可编辑；之后每条操作仍会重新检查权限
+        can_edit = await get_user_permission(db, document_id, connection.user_id) in (PermissionType.EDIT, PermissionType.ADMIN)
+    
+    if document_id not in connection.documents:
+        manager.subscribe(connection, document_id, can_edit)
+        document_cache.pin(document_id)
+        presence_hub.join(document_id, connection.user_id)
+    else:
+        connection.documents[document_id] = can_edit
+    
+    connection.send({
+        "type": "subscribed",
+        "data": {
+            "document_id": document_id,
+            "current_version": document_cache.version_of(document_id, stored_version),
+            "can_edit": can_edit
+        }
+    })
+    
+    if sync:
+        cached = await document_cache.load(document_id, stored_version)
+        payload = await initial_sync_cache.get_message(document_id, cached.content, cached.version, connection.codec)
+        connection.send_encoded(payload)
+
+
+def handle_unsubscribe(connection: Connection, document_id: int):
+    if document_id not in connection.documents:
+        return
+    manager.unsubscribe(connection, document_id)
+    if connection.user_id not in manager.get_subscribed_users(document_id):
+        # 同一用户的其他连接仍订阅该文档时保留其在线状态
+        presence_hub.leave(document_id, connection.user_id)
+    document_cache.unpin(document_id)
+
+
+def revoke_subscriptions(document_id: int, user_id: Optional[int]):
+    # 本进程或其他 worker 撤销了访问权限：退订相关连接并通知客户端，之后不再收到该文档的广播
+    permission_cache.invalidate(document_id, user_id)
+    for connection in list(manager.active_connections.get(document_id, {}).values()):
+        if user_id is None or connection.user_id == user_id:
+            handle_unsubscribe(connection, document_id)
+            connection.send({
+                "type": "access_revoked",
+                "data": {
+                    "document_id": document_id
+                }
+            })
+
+
+manager.on_access_revoked = revoke_subscriptions
+
+
 @router.websocket("/ws")
 async def websocket_endpoint(
     websocket: WebSocket,
     token: str = Query(...),
-    document_id: int = Query(...)
+    document_id: Optional[int] = Query(None),
+    protocol: str = Query("json"),
+    sync: bool = Query(False)
 ):
-    db = next(get_db())
+    # 一个客户端只需一个连接，通过 subscribe / unsubscribe 消息订阅或退订任意多个文档，
+    # 文档相关的消息在顶层带 document_id 指明目标文档。
+    # 兼容旧客户端：连接时带 document_id 参数会自动订阅该文档，消息未指明 document_id 时也默认发往该文档。
+    # 数据库会话只在握手和处理单条消息期间使用，空闲连接不占用连接池
     try:
-        user = await get_user_from_token(token, db)
-        
-        if not has_document_access(db, document_id, user.id, PermissionType.READ):
-            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-            return
+        async with AsyncSessionLocal() as db:
+            user = await get_user_from_token(token, db)
+            user_id = user.id
+            
+            if document_id is not None:
+                document = await db.scalar(select(Document).filter(Document.id == document_id))
+                if not document or not await has_document_access(db, document_id, user_id, PermissionType.READ):
+                    await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+                    return
+                current_version = document.current_version
         
-        document = db.query(Document).filter(Document.id == document_id).first()
-        
-        if not document:
-            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-            return
-        
-        await manager.connect(websocket, document_id, user.id)
-        
-        await websocket.send_json({
-            "type": "connected",
-            "data": {
-                "user_id": user.id,
-                "document_id": document_id,
-                "current_version": document.current_version
-            }
-        })
+        # protocol=msgpack 时收发 MessagePack 二进制帧，其余情况使用 JSON 文本帧
+        codec = get_codec(protocol)
+        connection = await manager.connect(websocket, user_id, codec)
+        heartbeat_scheduler.register(connection)
         
         try:
+            connection.send({
+                "type": "connected",
+                "data": {
+                    "user_id": user_id,
+                    "connection_id": connection.connection_id,
+                    "document_id": document_id,
+                    "current_version": document_cache.version_of(document_id, current_version) if document_id is not None else None,
+                    "protocol": codec.name
+                }
+            })
+            if document_id is not None:
+                await handle_subscribe(connection, document_id, sync)
+            
             while True:
-                data = await websocket.receive_text()
-                
                 try:
-                    message = json.loads(data)
+                    message = await receive_message(websocket, codec)
+                    connection.touch()
                     message_type = message.get("type")
                     
                     if message_type == "ping":
-                        await websocket.send_json({"type": "pong"})
-                    elif message_type == "subscribe":
-                        document = db.query(Document).filter(Document.id == document_id).first()
-                        await websocket.send_json({
-                            "type": "subscribed",
-                            "data": {
-                                "document_id": document_id,
-                                "current_version": document.current_version if document else 0
-                            }
-                        })
+                        connection.send({"type": "pong"})
+                        continue
+                    if message_type == "pong":
+                        # 对服务端心跳 ping 的响应，touch 已记录
+                        continue
+                    
+                    # subscribe / unsubscribe 的目标文档放在 data 中，其余消息放在顶层
+                    if message_type in ("subscribe", "unsubscribe"):
+                        target_id = (message.get("data") or {}).get("document_id", document_id)
                     else:
-                        await websocket.send_json({
-                            "type": "error",
+                        target_id = message.get("document_id", document_id)
+                    
+                    if message_type == "subscribe":
+                        await handle_subscribe(connection, target_id, bool((message.get("data") or {}).get("sync")))
+                        continue
+                    if message_type == "unsubscribe":
+                        if not is_document_id(target_id):
+                            send_error(connection, "unsubscribe 消息需要提供有效的 document_id")
+                            continue
+                        handle_unsubscribe(connection, target_id)
+                        connection.send({
+                            "type": "unsubscribed",
                             "data": {
-                                "message": f"未知的消息类型: {message_type}"
+                                "document_id": target_id
                             }
                         })
+                        continue
+                    
+                    if message_type not in ("operation", "catch_up", "cursor", "presence"):
+                        send_error(connection, f"未知的消息类型: {message_type}")
+                        continue
+                    if not is_document_id(target_id):
+                        send_error(connection, f"{message_type} 消息需要提供有效的 document_id")
+                        continue
+                    if target_id not in connection.documents:
+                        send_error(connection, f"未订阅文档 {target_id}", target_id)
+                        continue
+                    
+                    if message_type == "operation":
+                        await handle_operation(connection, target_id, message)
+                    elif message_type == "catch_up":
+                        await handle_catch_up(connection, target_id, message)
+                    else:
+                        # 只记录最新状态，由 presence_hub 定时合并广播
+                        schema = CursorUpdate if message_type == "cursor" else PresenceUpdate
+                        try:
+                            update = schema.model_validate(message.get("data") or {})
+                        except ValidationError as e:
+                            send_error(connection, f"无效的 {message_type} 消息: {e.errors()[0]['msg']}", target_id)
+                            continue
+                        presence_hub.update(target_id, user_id, update.model_dump(exclude_unset=True))
                 
-                except json.JSONDecodeError:
-                    await websocket.send_json({
-                        "type": "error",
-                        "data": {
-                            "message": "无效的 JSON 格式"
-                        }
-                    })
+                except ValueError:
+                    send_error(connection, f"无效的 {codec.label} 格式")
         
         except WebSocketDisconnect:
-            manager.disconnect(document_id, user.id)
+            pass
         finally:
-            db.close()
+            for subscribed_id in list(connection.documents):
+                handle_unsubscribe(connection, subscribed_id)
+            manager.disconnect(connection)
     
     except Exception as e:
         print(f"WebSocket 错误: {e}")
@@ -114,6 +334,4 @@ async def websocket_endpoint(
             await websocket.close()
         except:
             pass
-        finally:
-            db.close()
 
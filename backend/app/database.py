@@ -1,16 +1,55 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
 
+
+def _pool_options(url: str) -> dict:
+    # SQLite 使用 SQLAlchemy 默认的连接池，不支持这些参数
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": settings.DATABASE_POOL_SIZE,
+        "max_overflow": settings.DATABASE_MAX_OVERFLOW,
+        "pool_timeout": settings.DATABASE_POOL_TIMEOUT,
+        "pool_recycle": settings.DATABASE_POOL_RECYCLE,
+    }
+
+
+def _async_database_url() -> str:
+    if settings.ASYNC_DATABASE_URL:
+        return settings.ASYNC_DATABASE_URL
+    url = settings.DATABASE_URL
+    for prefix, async_prefix in (
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(prefix):
+            return async_prefix + url[len(prefix):]
+    return url
+
+
+# 同步引擎只用于后台任务（写回落盘、日志恢复、操作合并等），请求处理使用异步引擎，不阻塞事件循环
 engine = create_engine(
     settings.DATABASE_URL,
     pool_pre_ping=True,
-    echo=settings.DEBUG
+    echo=settings.DEBUG,
+    **_pool_options(settings.DATABASE_URL)
+)
+
+async_engine = create_async_engine(
+    _async_database_url(),
+    pool_pre_ping=True,
+    echo=settings.DEBUG,
+    **_pool_options(settings.DATABASE_URL)
 )
 
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 提交后不过期对象属性：异步会话中访问过期属性会触发隐式 IO 而报错
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 
@@ -21,3 +60,7 @@ def get_db():
     finally:
         db.close()
 
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,13 +1,43 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
 from app.api import auth, documents, websocket
+from app.storage.cache import document_cache
+from app.utils.permission import permission_cache
+from app.utils.jwt import token_cache, user_cache
+from app.utils.password import password_hasher
+from app.storage.write_behind import write_behind
+from app.storage.snapshots import operation_compactor
+from app.websocket.manager import manager
+from app.websocket.presence import presence_hub
+from app.websocket.batcher import operation_batcher
+from app.websocket.heartbeat import heartbeat_scheduler
+from app.websocket.sync import initial_sync_cache
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时重放未落盘的操作日志，关闭时把剩余的修改全部落盘
+    await write_behind.start()
+    await operation_compactor.start()
+    await manager.start()
+    await presence_hub.start()
+    await heartbeat_scheduler.start()
+    yield
+    await heartbeat_scheduler.stop()
+    await operation_batcher.stop()
+    await presence_hub.stop()
+    await manager.stop()
+    await operation_compactor.stop()
+    await write_behind.stop()
 
 
 app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
-    debug=settings.DEBUG
+    debug=settings.DEBUG,
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -33,7 +63,16 @@ async def root():
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "document_cache": document_cache.stats(),
+        "permission_cache": permission_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "websocket": heartbeat_scheduler.stats(),
+        "initial_sync": initial_sync_cache.stats()
+    }
 
 
 
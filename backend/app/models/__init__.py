@@ -1,7 +1,8 @@
 from app.models.user import User
 from app.models.document import Document
 from app.models.document_operation import DocumentOperation
+from app.models.document_snapshot import DocumentSnapshot
 from app.models.document_share import DocumentShare, PermissionType
 
-__all__ = ["User", "Document", "DocumentOperation", "DocumentShare", "PermissionType"]
+__all__ = ["User", "Document", "DocumentOperation", "DocumentSnapshot", "DocumentShare", "PermissionType"]
 
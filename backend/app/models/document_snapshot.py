@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship, backref
+from app.database import Base
+
+
+class DocumentSnapshot(Base):
+    __tablename__ = "document_snapshots"
+    __table_args__ = (UniqueConstraint("document_id", "version", name="uq_document_snapshot_version"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
+    version = Column(Integer, nullable=False, index=True)  # 快照对应的文档版本号
+    content_key = Column(String(64), nullable=False, index=True)  # 该版本完整内容在存储后端中的 blob 键（内容哈希）
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    
+    document = relationship("Document", backref=backref("snapshots", cascade="all, delete-orphan"))
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Literal, Optional, Dict, Any
+from typing import Literal, Optional, Dict, Any, List
 
 
 class OperationRequest(BaseModel):
@@ -10,3 +10,13 @@ class OperationRequest(BaseModel):
     marks: Optional[Dict[str, Any]] = Field(None, description="格式化标记（用于 format 操作）")
     base_version: int = Field(..., ge=0, description="操作基于的版本号")
 
+
+
+class OperationBatchRequest(BaseModel):
+    base_version: int = Field(..., ge=0, description="第一个操作基于的版本号")
+    operations: List[OperationRequest] = Field(
+        ...,
+        min_length=1,
+        max_length=1000,
+        description="按顺序应用的操作列表，第 i 个操作基于第 i-1 个操作之后的版本（各操作自身的 base_version 会被忽略）"
+    )
@@ -0,0 +1,17 @@
+from pydantic import BaseModel, Field
+from typing import Literal, Optional
+
+
+class Selection(BaseModel):
+    from_pos: int = Field(..., ge=0, description="选区起始位置")
+    to_pos: int = Field(..., ge=0, description="选区结束位置")
+
+
+class CursorUpdate(BaseModel):
+    cursor: Optional[int] = Field(None, ge=0, description="光标位置（字符索引）")
+    selection: Optional[Selection] = Field(None, description="当前选区")
+    version: Optional[int] = Field(None, ge=0, description="光标位置所基于的版本号")
+
+
+class PresenceUpdate(BaseModel):
+    status: Literal["active", "idle"] = Field(..., description="在线状态")
@@ -0,0 +1 @@
+"""文档存储"""
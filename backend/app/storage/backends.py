@@ -0,0 +1,164 @@
+import hashlib
+import mmap
+import os
+import re
+import zlib
+from typing import Callable, Iterator, Optional, Tuple, Union
+from app.config import settings
+
+# 按字节切片读取的文档内容：小文件为 bytes，大文件为只读内存映射
+ContentBytes = Union[bytes, mmap.mmap]
+
+
+class StorageBackend:
+    # 文档内容存储。每个文档的当前内容按 id 存放，写入时先写临时文件再原子替换；
+    # 快照等不可变内容按内容的 SHA-256 存为 blob，相同内容（例如相同的快照或模板）只存一份。
+    # 子类通过 encode/decode 决定落盘格式
+    suffix = ".md"
+    blob_suffix = ""
+
+    def __init__(self, root: str):
+        self.root = root
+        # 写回模式下先写入带版本号的暂存文件，数据库提交成功后再原子地重命名为正式文件
+        self._staged_pattern = re.compile(rf"^(\d+){re.escape(self.suffix)}\.v(\d+)\.pending$")
+
+    def encode(self, data: bytes) -> bytes:
+        return data
+
+    def decode(self, data: bytes) -> bytes:
+        return data
+
+    def document_path(self, document_id: int) -> str:
+        return os.path.join(self.root, f"{document_id}{self.suffix}")
+
+    def staged_path(self, document_id: int, version: int) -> str:
+        return f"{self.document_path(document_id)}.v{version}.pending"
+
+    def blob_path(self, key: str) -> str:
+        return os.path.join(self.root, "blobs", key[:2], f"{key}{self.blob_suffix}")
+
+    def read(self, document_id: int) -> str:
+        data = self._read_file(self.document_path(document_id))
+        return data.decode("utf-8") if data is not None else ""
+
+    def open(self, document_id: int) -> ContentBytes:
+        data = self._read_file(self.document_path(document_id))
+        return data if data is not None else b""
+
+    def write(self, document_id: int, content: str):
+        self._write_file(self.document_path(document_id), content.encode("utf-8"), atomic=True)
+
+    def delete(self, document_id: int):
+        path = self.document_path(document_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def stage(self, document_id: int, content: str, version: int, fsync: bool = True):
+        self._write_file(self.staged_path(document_id, version), content.encode("utf-8"), fsync=fsync)
+
+    def commit_staged(self, document_id: int, version: int):
+        os.replace(self.staged_path(document_id, version), self.document_path(document_id))
+
+    def discard_staged(self, document_id: int):
+        for name, staged_id, _ in self._staged_files():
+            if staged_id == document_id:
+                os.remove(os.path.join(self.root, name))
+
+    def recover_staged(self, get_stored_version: Callable[[int], Optional[int]]):
+        # 崩溃恢复：数据库已提交到暂存文件的版本则完成重命名，否则说明提交未完成，丢弃暂存文件
+        for name, document_id, version in self._staged_files():
+            if get_stored_version(document_id) == version:
+                self.commit_staged(document_id, version)
+            else:
+                os.remove(os.path.join(self.root, name))
+
+    def put_blob(self, content: str) -> str:
+        data = content.encode("utf-8")
+        key = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(key)
+        if not os.path.exists(path):
+            self._write_file(path, data, atomic=True, fsync=True)
+        return key
+
+    def get_blob(self, key: str) -> str:
+        data = self._read_file(self.blob_path(key))
+        if data is None:
+            raise FileNotFoundError(f"内容 {key} 不存在")
+        return data.decode("utf-8")
+
+    def delete_blob(self, key: str):
+        path = self.blob_path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _staged_files(self) -> Iterator[Tuple[str, int, int]]:
+        if not os.path.isdir(self.root):
+            return
+        for name in sorted(os.listdir(self.root)):
+            match = self._staged_pattern.match(name)
+            if match:
+                yield name, int(match.group(1)), int(match.group(2))
+
+    def _read_file(self, path: str) -> Optional[ContentBytes]:
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return self.decode(f.read())
+
+    def _write_file(self, path: str, data: bytes, atomic: bool = False, fsync: bool = False):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        target = f"{path}.tmp" if atomic else path
+        with open(target, "wb") as f:
+            f.write(self.encode(data))
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if atomic:
+            os.replace(target, path)
+
+
+class PlainFileBackend(StorageBackend):
+    # 默认后端：内容以 UTF-8 明文存为 {id}.md，大文件读取时使用内存映射
+
+    def _read_file(self, path: str) -> Optional[ContentBytes]:
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size >= settings.CONTENT_MMAP_THRESHOLD:
+                # 映射建立后不再依赖文件句柄
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return f.read()
+
+    def read(self, document_id: int) -> str:
+        path = self.document_path(document_id)
+        if not os.path.exists(path):
+            return ""
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+
+class CompressedBackend(StorageBackend):
+    # 压缩后端：文档与 blob 均以 zlib 压缩后存储，适合以文本为主的内容
+    suffix = ".md.z"
+    blob_suffix = ".z"
+
+    def __init__(self, root: str, level: int):
+        super().__init__(root)
+        self.level = level
+
+    def encode(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decode(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+def create_storage_backend() -> StorageBackend:
+    if settings.STORAGE_BACKEND == "plain":
+        return PlainFileBackend(settings.DOCUMENTS_DIR)
+    if settings.STORAGE_BACKEND == "compressed":
+        return CompressedBackend(settings.DOCUMENTS_DIR, settings.STORAGE_COMPRESSION_LEVEL)
+    raise ValueError(f"不支持的存储后端: {settings.STORAGE_BACKEND}")
+
+
+storage_backend = create_storage_backend()
@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from app.config import settings
+from app.storage.files import read_document_content
+from app.utils.operation import apply_operation
+from app.utils.rope import Rope
+
+# 内存占用按每字符 2 字节估算（覆盖 ASCII 与常用中文）
+BYTES_PER_CHAR = 2
+
+
+class CachedDocument:
+    def __init__(self, document_id: int, content: str, version: int):
+        self.document_id = document_id
+        self.buffer = Rope(content)
+        self.version = version
+        self.dirty = False  # 存在尚未落盘的修改（写回模式），此时缓存中的版本比数据库新
+        self.last_access = time.monotonic()
+
+    @property
+    def size(self) -> int:
+        return len(self.buffer) * BYTES_PER_CHAR
+
+    @property
+    def content(self) -> str:
+        return str(self.buffer)
+
+    def apply(self, operation: Dict[str, Any]) -> Tuple[int, int, str]:
+        # 应用操作并返回撤销所需的信息，持久化失败时用 revert 恢复
+        from_pos, to_pos = operation["from_pos"], operation["to_pos"]
+        removed = self.buffer[from_pos:to_pos]
+        length_before = len(self.buffer)
+        apply_operation(self.buffer, operation)
+        return from_pos, to_pos + len(self.buffer) - length_before, removed
+
+    def revert(self, undo: Tuple[int, int, str]):
+        start, stop, removed = undo
+        self.buffer.replace(start, stop, removed)
+
+
+def _is_current(entry: Optional[CachedDocument], version: int) -> bool:
+    return entry is not None and (entry.dirty or entry.version == version)
+
+
+class DocumentCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[int, CachedDocument]" = OrderedDict()
+        self._pins: Dict[int, int] = {}  # 正在编辑（有连接订阅）的文档，不会被淘汰
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def load(self, document_id: int, version: int) -> CachedDocument:
+        # 缓存中的版本与数据库不一致时（例如被其他进程修改）视为未命中并重新加载；
+        # 未命中时在线程池中读取（可能需要解压）文件，不阻塞事件循环
+        with self._lock:
+            entry = self._entries.get(document_id)
+            if _is_current(entry, version):
+                self.hits += 1
+                self._touch(entry)
+                return entry
+            self.misses += 1
+        content = await asyncio.get_running_loop().run_in_executor(None, read_document_content, document_id)
+        with self._lock:
+            # 读取文件期间其他请求可能已经加载或修改了这个文档，以缓存中的为准
+            entry = self._entries.get(document_id)
+            if _is_current(entry, version):
+                self._touch(entry)
+                return entry
+            return self._store(document_id, content, version)
+
+    def put(self, document_id: int, content: str, version: int) -> CachedDocument:
+        with self._lock:
+            return self._store(document_id, content, version)
+
+    def get(self, document_id: int) -> Optional[CachedDocument]:
+        with self._lock:
+            entry = self._entries.get(document_id)
+            if entry is not None:
+                self._touch(entry)
+            return entry
+
+    def version_of(self, document_id: int, stored_version: int) -> int:
+        entry = self._entries.get(document_id)
+        if entry is not None and entry.dirty:
+            return entry.version
+        return stored_version
+
+    def invalidate(self, document_id: int):
+        with self._lock:
+            self._entries.pop(document_id, None)
+
+    def pin(self, document_id: int):
+        with self._lock:
+            self._pins[document_id] = self._pins.get(document_id, 0) + 1
+
+    def unpin(self, document_id: int):
+        with self._lock:
+            count = self._pins.get(document_id, 0) - 1
+            if count > 0:
+                self._pins[document_id] = count
+            else:
+                self._pins.pop(document_id, None)
+            self._evict()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(entry.size for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _touch(self, entry: CachedDocument):
+        entry.last_access = time.monotonic()
+        self._entries.move_to_end(entry.document_id)
+
+    def _store(self, document_id: int, content: str, version: int) -> CachedDocument:
+        entry = CachedDocument(document_id, content, version)
+        self._entries[document_id] = entry
+        self._entries.move_to_end(document_id)
+        self._evict()
+        return entry
+
+    def _evict(self):
+        # 按最近最少使用的顺序淘汰空闲文档，正在编辑或未落盘的文档即使超出预算也保留
+        total = sum(entry.size for entry in self._entries.values())
+        if total <= self.max_bytes:
+            return
+        for document_id in list(self._entries.keys()):
+            if total <= self.max_bytes:
+                break
+            if self._pins.get(document_id) or self._entries[document_id].dirty:
+                continue
+            entry = self._entries.pop(document_id)
+            total -= entry.size
+            self.evictions += 1
+
+
+document_cache = DocumentCache(settings.DOCUMENT_CACHE_MAX_BYTES)
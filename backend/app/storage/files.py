@@ -0,0 +1,73 @@
+import mmap
+from typing import Callable, Iterator, Optional, Tuple
+from app.config import settings
+from app.storage.backends import ContentBytes, storage_backend
+
+
+def get_document_file_path(document_id: int) -> str:
+    return storage_backend.document_path(document_id)
+
+
+def read_document_content(document_id: int) -> str:
+    return storage_backend.read(document_id)
+
+
+def write_document_content(document_id: int, content: str):
+    # 先写临时文件再原子替换，正在读取（或内存映射）旧文件的请求不受影响
+    storage_backend.write(document_id, content)
+
+
+def open_document_content(document_id: int) -> ContentBytes:
+    return storage_backend.open(document_id)
+
+
+def find_line_range(content: ContentBytes, from_line: int, to_line: Optional[int]) -> Tuple[int, int]:
+    # 返回第 [from_line, to_line) 行（从 0 开始）对应的字节范围，to_line 为 None 时直到末尾
+    start = 0
+    for _ in range(from_line):
+        pos = content.find(b"\n", start)
+        if pos == -1:
+            return len(content), len(content)
+        start = pos + 1
+    if to_line is None:
+        return start, len(content)
+    end = start
+    for _ in range(max(to_line - from_line, 0)):
+        pos = content.find(b"\n", end)
+        if pos == -1:
+            return start, len(content)
+        end = pos + 1
+    return start, end
+
+
+def iter_content_range(content: ContentBytes, start: int, end: int) -> Iterator[bytes]:
+    try:
+        for offset in range(start, end, settings.CONTENT_STREAM_CHUNK_SIZE):
+            yield content[offset:min(offset + settings.CONTENT_STREAM_CHUNK_SIZE, end)]
+    finally:
+        close_content(content)
+
+
+def close_content(content: ContentBytes):
+    if isinstance(content, mmap.mmap):
+        content.close()
+
+
+def delete_document_content(document_id: int):
+    storage_backend.delete(document_id)
+
+
+def stage_document_content(document_id: int, content: str, version: int, fsync: bool = True):
+    storage_backend.stage(document_id, content, version, fsync)
+
+
+def commit_staged_content(document_id: int, version: int):
+    storage_backend.commit_staged(document_id, version)
+
+
+def discard_staged_contents(document_id: int):
+    storage_backend.discard_staged(document_id)
+
+
+def recover_staged_contents(get_stored_version: Callable[[int], Optional[int]]):
+    storage_backend.recover_staged(get_stored_version)
@@ -0,0 +1,141 @@
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models.document import Document
+from app.models.document_operation import DocumentOperation
+from app.storage.cache import CachedDocument
+from app.storage.snapshots import nearest_snapshot, read_snapshot
+from app.storage.write_behind import write_behind
+from app.utils.operation import apply_operation
+from app.utils.rope import Rope
+
+
+class OperationHistory:
+    # 每个文档最近若干个已应用操作的内存窗口，用于快速变换基于旧版本的操作
+    def __init__(self, window: int, max_documents: int):
+        self.window = window
+        self.max_documents = max_documents
+        self._entries: "OrderedDict[int, Deque[Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def append(self, document_id: int, records: List[Dict[str, Any]]):
+        with self._lock:
+            entries = self._entries.get(document_id)
+            if entries is None:
+                entries = self._entries[document_id] = deque(maxlen=self.window)
+            elif entries and records and entries[-1]["version_after"] != records[0]["version_before"]:
+                # 中间有缺口（例如被其他进程修改过），旧窗口已不连续
+                entries.clear()
+            entries.extend(records)
+            self._entries.move_to_end(document_id)
+            while len(self._entries) > self.max_documents:
+                self._entries.popitem(last=False)
+
+    def since(self, document_id: int, version: int, current_version: int) -> Optional[List[Dict[str, Any]]]:
+        # 返回从 version 到 current_version 的连续操作；窗口无法完整覆盖时返回 None
+        with self._lock:
+            entries = self._entries.get(document_id)
+            if not entries or entries[0]["version_before"] > version or entries[-1]["version_after"] != current_version:
+                return None
+            return [record for record in entries if record["version_before"] >= version]
+
+    def discard(self, document_id: int):
+        with self._lock:
+            self._entries.pop(document_id, None)
+
+
+operation_history = OperationHistory(settings.OT_HISTORY_WINDOW, settings.OT_HISTORY_MAX_DOCUMENTS)
+
+
+def operations_since(db: Session, document_id: int, version: int, current_version: int) -> Optional[List[Dict[str, Any]]]:
+    # 优先使用内存窗口，否则从 document_operations 表（加上写回模式下尚未落盘的操作）中读取
+    if version == current_version:
+        return []
+    records = operation_history.since(document_id, version, current_version)
+    if records is not None:
+        return records
+
+    rows = db.query(DocumentOperation).filter(
+        DocumentOperation.document_id == document_id,
+        DocumentOperation.version_before >= version
+    ).order_by(DocumentOperation.version_before).all()
+    records = [
+        {
+            "document_id": row.document_id,
+            "user_id": row.user_id,
+            "operation": row.operation_data,
+            "version_before": row.version_before,
+            "version_after": row.version_after,
+            "timestamp": row.timestamp.isoformat()
+        }
+        for row in rows
+    ]
+    stored_version = records[-1]["version_after"] if records else version
+    records += [record for record in write_behind.pending_records(document_id) if record["version_before"] >= stored_version]
+
+    expected = version
+    for record in records:
+        if record["version_before"] != expected:
+            return None
+        expected = record["version_after"]
+    return records if expected == current_version else None
+
+
+def document_at_version(db: Session, document_id: int, version: int) -> Optional[str]:
+    # 从不晚于 version 的最近快照开始，只重放其后的操作；缺少快照或中间版本已被合并时返回 None
+    snapshot = nearest_snapshot(db, document_id, version)
+    if snapshot is None:
+        return None
+    if snapshot.version == version:
+        return read_snapshot(snapshot)
+    
+    rows = db.query(DocumentOperation).filter(
+        DocumentOperation.document_id == document_id,
+        DocumentOperation.version_before >= snapshot.version,
+        DocumentOperation.version_after <= version
+    ).order_by(DocumentOperation.version_before).all()
+    records = [(row.version_before, row.version_after, row.operation_data) for row in rows]
+    stored_version = records[-1][1] if records else snapshot.version
+    records += [
+        (record["version_before"], record["version_after"], record["operation"])
+        for record in write_behind.pending_records(document_id)
+        if record["version_before"] >= stored_version and record["version_after"] <= version
+    ]
+    
+    buffer = Rope(read_snapshot(snapshot))
+    expected = snapshot.version
+    for version_before, version_after, operation in records:
+        if version_before != expected:
+            return None
+        apply_operation(buffer, operation)
+        expected = version_after
+    return str(buffer) if expected == version else None
+
+
+def catch_up(db: Session, document: Document, cached: CachedDocument, since: int) -> Dict[str, Any]:
+    # 客户端从 since 版本补齐到当前版本：落后不多时只返回期间的操作，
+    # 落后太多或历史不完整（例如已被合并）时返回当前完整内容。
+    # cached 由调用方通过 document_cache.load 加载，未命中时的文件读取不在事件循环中进行
+    if since > cached.version:
+        raise ValueError(f"版本 {since} 不存在，当前版本是 {cached.version}")
+    
+    records = None
+    if cached.version - since <= settings.CATCH_UP_MAX_OPERATIONS:
+        records = operations_since(db, document.id, since, cached.version)
+    if records is None:
+        return {
+            "document_id": document.id,
+            "mode": "snapshot",
+            "since": since,
+            "version": cached.version,
+            "content": cached.content
+        }
+    return {
+        "document_id": document.id,
+        "mode": "operations",
+        "since": since,
+        "version": cached.version,
+        "operations": [{**record["operation"], "version": record["version_after"]} for record in records]
+    }
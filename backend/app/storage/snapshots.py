@@ -0,0 +1,237 @@
+import asyncio
+import os
+import threading
+from typing import Any, Dict, List, Optional, Set
+from sqlalchemy import event, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import SessionLocal
+from app.models.document import Document
+from app.models.document_operation import DocumentOperation
+from app.models.document_snapshot import DocumentSnapshot
+from app.storage.backends import storage_backend
+
+
+# 写入 blob 与删除 blob 互斥；_pending_blobs 记录已写入、但所在事务尚未结束的 blob 及其引用数
+_blob_lock = threading.Lock()
+_pending_blobs: Dict[str, int] = {}
+
+
+def _change_size(operation: Dict[str, Any]) -> int:
+    return operation["to_pos"] - operation["from_pos"] + len(operation.get("content") or "")
+
+
+class SnapshotPolicy:
+    # 每累积 SNAPSHOT_INTERVAL_OPERATIONS 个操作或 SNAPSHOT_INTERVAL_BYTES 个修改字符保存一次完整快照，
+    # 获取历史版本时只需从最近的快照开始重放
+    def __init__(self, every_operations: int, every_bytes: int):
+        self.every_operations = every_operations
+        self.every_bytes = every_bytes
+        self._progress: Dict[int, List[int]] = {}  # 文档 id -> [上次快照的版本, 此后累积修改的字符数]
+
+    def record(self, db: Session, document_id: int, records: List[Dict[str, Any]], content: str, version: int):
+        # 在提交版本号和操作记录的同一个事务中调用，达到阈值时把快照加入该事务
+        if self.due(db, document_id, records, version):
+            add_snapshot(db, document_id, version, content)
+
+    def due(self, db: Session, document_id: int, records: List[Dict[str, Any]], version: int) -> bool:
+        # 返回这批操作提交后是否需要保存快照；需要时由调用方把快照加入同一个事务
+        progress = self._progress.get(document_id)
+        if progress is None:
+            latest = db.query(func.max(DocumentSnapshot.version)).filter(
+                DocumentSnapshot.document_id == document_id
+            ).scalar()
+            progress = [latest or 0, 0]
+        progress[1] += sum(_change_size(record["operation"]) for record in records)
+        due = version - progress[0] >= self.every_operations or progress[1] >= self.every_bytes
+        self._progress[document_id] = [version, 0] if due else progress
+        return due
+
+    def discard(self, document_id: int):
+        self._progress.pop(document_id, None)
+
+
+snapshot_policy = SnapshotPolicy(settings.SNAPSHOT_INTERVAL_OPERATIONS, settings.SNAPSHOT_INTERVAL_BYTES)
+
+
+def add_snapshot(db: Session, document_id: int, version: int, content: str):
+    # 内容按哈希存为 blob，相同内容的快照（包括用相同模板创建的文档）共用一份
+    db.add(DocumentSnapshot(document_id=document_id, version=version, content_key=store_blob(db, content)))
+
+
+async def add_snapshot_async(db: AsyncSession, document_id: int, version: int, content: str):
+    # 异步会话使用：blob 的写入（包括 fsync）在线程池中执行，不阻塞事件循环
+    content_key = await asyncio.get_running_loop().run_in_executor(None, store_blob, db.sync_session, content)
+    db.add(DocumentSnapshot(document_id=document_id, version=version, content_key=content_key))
+
+
+def store_blob(db: Session, content: str) -> str:
+    # 写入（或复用已有的）blob 并登记到会话的事务：事务结束之前快照记录对其他会话不可见，
+    # 此期间 delete_blobs 靠这份登记跳过它，避免复用的 blob 被正在删除文档的请求删掉
+    with _blob_lock:
+        key = storage_backend.put_blob(content)
+        _pending_blobs[key] = _pending_blobs.get(key, 0) + 1
+    db.info.setdefault("pending_blobs", []).append(key)
+    return key
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _release_pending_blobs(session: Session, transaction):
+    # 最外层事务结束（提交、回滚或会话关闭）时取消登记；提交的快照记录此时已对其他会话可见
+    if transaction.parent is not None:
+        return
+    keys = session.info.pop("pending_blobs", None)
+    if not keys:
+        return
+    with _blob_lock:
+        for key in keys:
+            count = _pending_blobs[key] - 1
+            if count > 0:
+                _pending_blobs[key] = count
+            else:
+                del _pending_blobs[key]
+
+
+def read_snapshot(snapshot: DocumentSnapshot) -> str:
+    return storage_backend.get_blob(snapshot.content_key)
+
+
+def orphaned_snapshot_blobs(db: Session, document_id: int) -> Set[str]:
+    # 删除文档前调用：返回只被该文档的快照引用的 blob，待数据库提交后交给 delete_blobs
+    keys = {key for key, in db.query(DocumentSnapshot.content_key).filter(DocumentSnapshot.document_id == document_id)}
+    if not keys:
+        return keys
+    shared = db.query(DocumentSnapshot.content_key).filter(
+        DocumentSnapshot.content_key.in_(keys),
+        DocumentSnapshot.document_id != document_id
+    )
+    return keys - {key for key, in shared}
+
+
+def delete_blobs(keys: Set[str]):
+    # 在删除文档的事务提交后调用。期间其他文档可能保存了相同内容的快照并复用了这些 blob，
+    # 因此在锁内重新确认没有任何快照引用、也没有尚未结束的事务写入后才删除
+    if not keys:
+        return
+    with _blob_lock:
+        db = SessionLocal()
+        try:
+            referenced = {key for key, in db.query(DocumentSnapshot.content_key).filter(DocumentSnapshot.content_key.in_(keys))}
+        finally:
+            db.close()
+        for key in keys - referenced - set(_pending_blobs):
+            storage_backend.delete_blob(key)
+
+
+def nearest_snapshot(db: Session, document_id: int, version: int) -> Optional[DocumentSnapshot]:
+    return db.query(DocumentSnapshot).filter(
+        DocumentSnapshot.document_id == document_id,
+        DocumentSnapshot.version <= version
+    ).order_by(DocumentSnapshot.version.desc()).first()
+
+
+def _diff_operation(old: str, new: str) -> Dict[str, Any]:
+    # 用一个操作描述从 old 到 new 的变化：去掉公共前后缀，中间部分整体替换
+    prefix = len(os.path.commonprefix([old, new]))
+    limit = min(len(old), len(new)) - prefix
+    suffix = 0
+    while suffix < limit and old[len(old) - 1 - suffix] == new[len(new) - 1 - suffix]:
+        suffix += 1
+    from_pos, to_pos = prefix, len(old) - suffix
+    content = new[prefix:len(new) - suffix]
+    if from_pos == to_pos:
+        return {"type": "insert", "from_pos": from_pos, "to_pos": to_pos, "content": content, "marks": None}
+    if not content:
+        return {"type": "delete", "from_pos": from_pos, "to_pos": to_pos, "content": None, "marks": None}
+    return {"type": "replace", "from_pos": from_pos, "to_pos": to_pos, "content": content, "marks": None}
+
+
+def _compact_document(db: Session, document_id: int, up_to_version: int) -> int:
+    snapshots = db.query(DocumentSnapshot).filter(
+        DocumentSnapshot.document_id == document_id,
+        DocumentSnapshot.version <= up_to_version
+    ).order_by(DocumentSnapshot.version).all()
+    
+    merged = 0
+    contents: Dict[int, str] = {}
+    for start, end in zip(snapshots, snapshots[1:]):
+        range_filter = (
+            DocumentOperation.document_id == document_id,
+            DocumentOperation.version_before >= start.version,
+            DocumentOperation.version_after <= end.version
+        )
+        rows = db.query(DocumentOperation).filter(*range_filter).order_by(DocumentOperation.version_before).all()
+        if len(rows) <= 1:
+            # 已经合并过
+            continue
+        if rows[0].version_before != start.version or rows[-1].version_after != end.version:
+            # 操作记录不完整，保持原样
+            continue
+        
+        for snapshot in (start, end):
+            if snapshot.version not in contents:
+                contents[snapshot.version] = read_snapshot(snapshot)
+        operation = _diff_operation(contents.pop(start.version), contents[end.version])
+        db.query(DocumentOperation).filter(*range_filter).delete(synchronize_session=False)
+        db.add(DocumentOperation(
+            document_id=document_id,
+            user_id=rows[-1].user_id,
+            operation_type=operation["type"],
+            operation_data={**operation, "base_version": start.version, "compacted_operations": len(rows)},
+            sequence_number=end.version,
+            version_before=start.version,
+            version_after=end.version,
+            timestamp=rows[-1].timestamp
+        ))
+        merged += len(rows)
+    return merged
+
+
+def compact_operations() -> int:
+    # 把相邻两个快照之间的操作合并为一条等价操作，只处理 COMPACTION_RETAIN_OPERATIONS 个版本以前的范围。
+    # 合并后的中间版本无法再单独获取，快照所在的版本不受影响
+    db = SessionLocal()
+    try:
+        merged = 0
+        for document_id, current_version in db.query(Document.id, Document.current_version).all():
+            merged += _compact_document(db, document_id, current_version - settings.COMPACTION_RETAIN_OPERATIONS)
+            db.commit()
+        return merged
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class OperationCompactor:
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if settings.COMPACTION_ENABLED:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(settings.COMPACTION_INTERVAL)
+            try:
+                merged = await loop.run_in_executor(None, compact_operations)
+                if merged:
+                    print(f"合并了 {merged} 条旧操作记录")
+            except Exception as e:
+                print(f"合并操作记录失败: {e}")
+
+
+operation_compactor = OperationCompactor()
@@ -0,0 +1,278 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+from app.config import settings
+from app.database import SessionLocal
+from app.models.document import Document
+from app.models.document_operation import DocumentOperation
+from app.storage.cache import CachedDocument, document_cache
+from app.storage.files import (
+    read_document_content,
+    stage_document_content,
+    commit_staged_content,
+    discard_staged_contents,
+    recover_staged_contents,
+)
+from app.storage.journal import OperationJournal
+from app.storage.snapshots import snapshot_policy, add_snapshot_async
+from app.utils.operation import apply_operation
+from app.utils.sequencer import document_sequencer
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+
+class VersionConflict(Exception):
+    # 提交时数据库中的版本已不是这批操作的基础版本：同一文档被其他进程（worker）抢先提交了新版本
+    pass
+
+
+def build_operation_record(document_id: int, user_id: int, operation: Dict[str, Any], version_before: int) -> Dict[str, Any]:
+    return {
+        "document_id": document_id,
+        "user_id": user_id,
+        "operation": operation,
+        "version_before": version_before,
+        "version_after": version_before + 1,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
+
+def build_operation_rows(records: List[Dict[str, Any]]) -> List[DocumentOperation]:
+    return [
+        DocumentOperation(
+            document_id=record["document_id"],
+            user_id=record["user_id"],
+            operation_type=record["operation"]["type"],
+            operation_data=record["operation"],
+            sequence_number=record["version_after"],
+            version_before=record["version_before"],
+            version_after=record["version_after"],
+            timestamp=datetime.fromisoformat(record["timestamp"])
+        )
+        for record in records
+    ]
+
+
+class WriteBehindStore:
+    # 写回模式：接受的操作先组提交到追加写日志，文档文件与数据库版本由后台任务按间隔或操作数批量落盘
+    def __init__(self, journal_dir: str):
+        self.journal = OperationJournal(journal_dir)
+        self._pending: Dict[int, List[Dict[str, Any]]] = {}
+        self._pending_count = 0
+        self._appending: Set[int] = set()  # 正在写日志、尚未计入待落盘队列的文档
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return settings.PERSISTENCE_MODE == "write_behind"
+
+    async def append(self, cached: CachedDocument, records: List[Dict[str, Any]]):
+        # 调用方需在该文档的 actor 中执行；日志写入成功（已 fsync）后才计入待落盘队列
+        self._appending.add(cached.document_id)
+        try:
+            await self.journal.append(records)
+        finally:
+            self._appending.discard(cached.document_id)
+        cached.dirty = True
+        self._pending.setdefault(cached.document_id, []).extend(records)
+        self._pending_count += len(records)
+        if self._pending_count >= settings.WRITE_BEHIND_FLUSH_OPERATIONS:
+            self._wakeup.set()
+
+    def pending_records(self, document_id: int) -> List[Dict[str, Any]]:
+        return list(self._pending.get(document_id, []))
+
+    def discard(self, document_id: int):
+        records = self._pending.pop(document_id, [])
+        self._pending_count -= len(records)
+        discard_staged_contents(document_id)
+
+    async def start(self):
+        # 同步原语绑定到当前事件循环
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        # 两种模式都通过暂存文件写入文档内容，先处理上次退出时遗留的暂存文件
+        self._recover_staged()
+        if self.journal.segments() or self.enabled:
+            self.journal.open()
+            self._recover()
+            await self.flush()
+        if self.enabled:
+            self._task = asyncio.create_task(self._run())
+        else:
+            self.journal.close()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.journal.is_open:
+            await self.flush()
+            self.journal.close()
+
+    async def flush(self) -> bool:
+        async with self._flush_lock:
+            self._wakeup.clear()
+            closed_segment = self.journal.rotate() if self.journal.is_open else None
+            # 只处理有待落盘操作的文档，以及正在写日志的文档（其记录可能已写入即将删除的日志段）。
+            # 不能遍历所有存活的 actor：每次落盘都会重置 actor 的空闲计时，使其永远不会退出
+            document_ids = set(self._pending) | self._appending
+            ok = True
+            for document_id in document_ids:
+                ok = await self._flush_document(document_id) and ok
+            if ok and closed_segment is not None:
+                self.journal.delete_segments(closed_segment)
+            return ok
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.WRITE_BEHIND_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"后台落盘失败: {e}")
+
+    async def _flush_document(self, document_id: int) -> bool:
+        # 在文档的 actor 中取出待落盘操作和对应的内容快照，保证二者一致
+        async def take_snapshot():
+            records = self._pending.pop(document_id, [])
+            self._pending_count -= len(records)
+            cached = document_cache.get(document_id)
+            if not records or cached is None:
+                return records, None, "", 0
+            return records, cached, cached.content, cached.version
+
+        records, cached, content, version = await document_sequencer.submit(document_id, take_snapshot, bypass_limit=True)
+        if cached is None:
+            return True
+
+        # 文件写入与同步数据库事务都是阻塞调用，放到线程池中执行
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, stage_document_content, document_id, content, version)
+            if await loop.run_in_executor(None, self._commit_records, document_id, records, content, version):
+                await loop.run_in_executor(None, commit_staged_content, document_id, version)
+            else:
+                await loop.run_in_executor(None, discard_staged_contents, document_id)
+        except Exception as e:
+            print(f"文档 {document_id} 落盘失败: {e}")
+            await loop.run_in_executor(None, discard_staged_contents, document_id)
+            self._pending[document_id] = records + self._pending.get(document_id, [])
+            self._pending_count += len(records)
+            return False
+
+        if cached.version == version:
+            cached.dirty = False
+        return True
+
+    def _commit_records(self, document_id: int, records: List[Dict[str, Any]], content: str, version: int) -> bool:
+        # 版本号、操作记录与（需要时的）快照在同一个事务中提交
+        db = SessionLocal()
+        try:
+            document = db.query(Document).filter(Document.id == document_id).first()
+            if not document:
+                return False
+            document.current_version = version
+            db.add_all(build_operation_rows(records))
+            snapshot_policy.record(db, document_id, records, content, version)
+            db.commit()
+            return True
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _recover_staged(self):
+        db = SessionLocal()
+        try:
+            recover_staged_contents(lambda document_id: _stored_version(db, document_id))
+        finally:
+            db.close()
+
+    def _recover(self):
+        # 启动时重放日志中尚未落盘的尾部：跳过数据库中已有的版本，其余操作重新应用并标记为待落盘
+        db = SessionLocal()
+        try:
+            records_by_document = defaultdict(list)
+            for record in self.journal.read_records():
+                records_by_document[record["document_id"]].append(record)
+
+            for document_id, records in records_by_document.items():
+                version = _stored_version(db, document_id)
+                if version is None:
+                    continue
+                cached = CachedDocument(document_id, read_document_content(document_id), version)
+                replayed = []
+                for record in records:
+                    if record["version_before"] != cached.version:
+                        continue
+                    try:
+                        apply_operation(cached.buffer, record["operation"])
+                    except ValueError as e:
+                        print(f"重放文档 {document_id} 的操作失败: {e}")
+                        break
+                    cached.version = record["version_after"]
+                    replayed.append(record)
+                if replayed:
+                    cached = document_cache.put(document_id, cached.content, cached.version)
+                    cached.dirty = True
+                    self._pending[document_id] = replayed
+                    self._pending_count += len(replayed)
+        finally:
+            db.close()
+
+
+def _stored_version(db: Session, document_id: int) -> Optional[int]:
+    document = db.query(Document).filter(Document.id == document_id).first()
+    return document.current_version if document else None
+
+
+write_behind = WriteBehindStore(settings.JOURNAL_DIR)
+
+
+async def persist_operations(db: AsyncSession, document: Document, cached: CachedDocument, records: List[Dict[str, Any]]):
+    # 写回模式下只追加日志；同步模式下在一个事务中提交版本号、操作记录和快照，并立即写文件。
+    # 文件先写入暂存文件，提交成功后再替换正式文件，提交失败时丢弃，正式文件不会领先于数据库的版本；
+    # 提交后、替换前崩溃时由启动时的 recover_staged_contents 完成替换
+    if write_behind.enabled:
+        await write_behind.append(cached, records)
+        return
+    # 文件与快照 blob 的写入在线程池中执行，不阻塞事件循环。
+    # 整个文件都要重写，拼接完整内容的代价与写入相当；拼接结果由 Rope 缓存，下次修改前的读取直接复用
+    loop = asyncio.get_running_loop()
+    content = cached.content
+    version = records[-1]["version_after"]
+    await loop.run_in_executor(None, stage_document_content, document.id, content, version, settings.SYNC_PERSIST_FSYNC)
+    try:
+        # 条件更新：只有数据库中的版本仍是这批操作的基础版本时才提交。
+        # 单进程内由 actor 保证顺序，多个 worker 同时编辑同一文档时只有一个能提交，其余抛出 VersionConflict
+        result = await db.execute(
+            update(Document)
+            .where(Document.id == document.id, Document.current_version == records[0]["version_before"])
+            .values(current_version=version)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            raise VersionConflict(f"文档 {document.id} 的版本已被其他进程修改")
+        set_committed_value(document, "current_version", version)
+        db.add_all(build_operation_rows(records))
+        if await db.run_sync(lambda session: snapshot_policy.due(session, document.id, records, version)):
+            await add_snapshot_async(db, document.id, version, content)
+        await db.commit()
+    except Exception:
+        await loop.run_in_executor(None, discard_staged_contents, document.id)
+        raise
+    await loop.run_in_executor(None, commit_staged_content, document.id, version)
@@ -1,5 +1,5 @@
 from app.utils.jwt import create_access_token, verify_token, get_current_user
-from app.utils.password import verify_password, get_password_hash
+from app.utils.password import verify_password, get_password_hash, password_hasher
 
 __all__ = [
     "create_access_token",
@@ -7,6 +7,7 @@ __all__ = [
     "get_current_user",
     "verify_password",
     "get_password_hash",
+    "password_hasher",
 ]
 
 
@@ -0,0 +1,199 @@
+import asyncio
+from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Any, Optional, Tuple
+from app.models.document import Document
+from app.websocket.manager import manager
+from app.websocket.batcher import operation_batcher
+from app.storage.cache import CachedDocument, document_cache
+from app.storage.write_behind import build_operation_record, persist_operations, VersionConflict
+from app.storage.history import operation_history, operations_since
+from app.utils.ot import rebase_operations
+from app.utils.operation import format_selection
+from app.utils.sequencer import document_sequencer, SequencerBusy
+from app.config import settings
+
+# 多 worker 同时编辑同一文档、提交时版本已变化后最多重试的次数
+MAX_CONFLICT_RETRIES = 3
+
+
+async def apply_operations(
+    db: AsyncSession,
+    document: Document,
+    user_id: int,
+    base_version: int,
+    operations: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], int]:
+    # 依次把操作应用到缓存中的文档并一次性持久化，任何一步失败都会撤销全部修改。
+    # 操作基于旧版本时，先对期间已应用的操作做变换（OT）再应用
+    async def apply_once() -> Tuple[List[Dict[str, Any]], int]:
+        # 文档对象在排队前加载，期间之前排队的编辑可能已提交了新版本，必须在 actor 中重新读取版本号，
+        # 否则会把新内容的文件标记为旧版本并跳过变换（提交冲突回滚后对象的其他属性也已过期，一并刷新）
+        await db.refresh(document)
+        cached = await _load_current(db, document)
+        start_version = cached.version
+        to_apply = operations
+        
+        rebased = base_version != start_version
+        if rebased:
+            history = None
+            if base_version < start_version and start_version - base_version <= settings.OT_MAX_REBASE_OPERATIONS:
+                history = await db.run_sync(
+                    lambda session: operations_since(session, document.id, base_version, start_version)
+                )
+            if history is None:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail=f"版本冲突：操作基于版本 {base_version}，但当前版本是 {start_version}"
+                )
+            try:
+                to_apply = rebase_operations(operations, [record["operation"] for record in history])
+            except ValueError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail=f"版本冲突：操作基于版本 {base_version}，无法变换到版本 {start_version}: {str(e)}"
+                )
+        
+        undos = []
+        records = []
+        try:
+            for index, operation in enumerate(to_apply):
+                undo = cached.apply(operation)
+                undos.append(undo)
+                if operation["type"] == "format":
+                    # 记录格式化实际做出的修改，之后基于旧版本的操作按它做变换
+                    _, edits = format_selection(undo[2], operation["marks"])
+                    from_pos = operation["from_pos"]
+                    operation = {
+                        **operation,
+                        "edits": [[from_pos + start, from_pos + stop, text] for start, stop, text in edits]
+                    }
+                records.append(build_operation_record(
+                    document.id, user_id, {**operation, "base_version": cached.version}, cached.version
+                ))
+                cached.version += 1
+        except ValueError as e:
+            _revert_operations(cached, undos, start_version)
+            if rebased:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail=f"版本冲突：操作基于版本 {base_version}，变换到版本 {start_version} 后无法应用: {str(e)}"
+                )
+            prefix = "操作应用失败" if len(to_apply) == 1 else f"第 {index + 1} 个操作应用失败"
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"{prefix}: {str(e)}"
+            )
+        
+        if not records:
+            # 操作被并发修改完全覆盖，无需应用
+            return records, start_version
+        
+        try:
+            await persist_operations(db, document, cached, records)
+        except Exception:
+            # 持久化失败时撤销对缓存的修改，保持缓存与已持久化的内容一致
+            await db.rollback()
+            _revert_operations(cached, undos, start_version)
+            raise
+        
+        operation_history.append(document.id, records)
+        return records, cached.version
+    
+    async def apply() -> Tuple[List[Dict[str, Any]], int]:
+        # 提交时发现其他 worker 抢先提交了新版本：缓存已撤销，重新读取版本并对新增的操作做变换后重试
+        for attempt in range(MAX_CONFLICT_RETRIES + 1):
+            try:
+                return await apply_once()
+            except VersionConflict:
+                if attempt == MAX_CONFLICT_RETRIES:
+                    raise HTTPException(
+                        status_code=status.HTTP_409_CONFLICT,
+                        detail="版本冲突：文档正在被其他进程同时编辑，请稍后重试"
+                    )
+    
+    # 同一文档的编辑由单写者 actor 严格按顺序执行，避免并发请求读到相同的版本。
+    # actor 使用的是调用方的数据库会话：调用方被取消时仍等待任务结束，避免会话在使用中被关闭
+    submission = asyncio.ensure_future(document_sequencer.submit(document.id, apply))
+    try:
+        return await asyncio.shield(submission)
+    except asyncio.CancelledError:
+        await asyncio.wait([submission])
+        raise
+    except SequencerBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="文档编辑繁忙，请稍后重试"
+        )
+
+
+async def broadcast_records(
+    document_id: int,
+    records: List[Dict[str, Any]],
+    exclude_user_id: Optional[int] = None,
+    exclude_connection_id: Optional[str] = None
+):
+    # 给出发起操作的 connection_id 时只排除该连接，同一用户在其他标签页中打开的连接仍会收到
+    if not records:
+        return
+    
+    if settings.BROADCAST_MODE == "batched":
+        # 批量帧发给所有订阅者，发起操作的连接由帧中每个操作的 connection_id 标明
+        await operation_batcher.add(document_id, records, exclude_connection_id)
+        return
+    
+    if len(records) == 1:
+        operation_data = {**records[0]["operation"], "version": records[0]["version_after"]}
+        message = {
+            "type": "operation_applied",
+            "data": {
+                "document_id": document_id,
+                "operation": operation_data,
+                "version": records[0]["version_after"]
+            }
+        }
+    else:
+        message = {
+            "type": "operations_applied",
+            "data": {
+                "document_id": document_id,
+                "operations": [
+                    {**record["operation"], "version": record["version_after"]}
+                    for record in records
+                ],
+                "base_version": records[0]["version_before"],
+                "version": records[-1]["version_after"]
+            }
+        }
+    
+    if exclude_connection_id is not None:
+        await manager.broadcast_to_document(message, document_id, exclude_connection_id=exclude_connection_id)
+    else:
+        await manager.broadcast_to_document(message, document_id, exclude_user_id=exclude_user_id)
+
+
+async def _load_current(db: AsyncSession, document: Document) -> CachedDocument:
+    # 缓存落后于数据库（其他 worker 提交了新版本）时优先用数据库中的操作记录补齐，
+    # 不重新读取文件：对方可能已提交数据库、但还没把暂存文件替换为正式文件
+    cached = document_cache.get(document.id)
+    if cached is not None and not cached.dirty and cached.version < document.current_version:
+        start_version = cached.version
+        records = await db.run_sync(
+            lambda session: operations_since(session, document.id, start_version, document.current_version)
+        )
+        if records is not None:
+            undos = []
+            try:
+                for record in records:
+                    undos.append(cached.apply(record["operation"]))
+            except ValueError:
+                _revert_operations(cached, undos, start_version)
+            else:
+                cached.version = document.current_version
+    return await document_cache.load(document.id, document.current_version)
+
+
+def _revert_operations(cached: CachedDocument, undos: List[Tuple[int, int, str]], base_version: int):
+    for undo in reversed(undos):
+        cached.revert(undo)
+    cached.version = base_version
@@ -1,16 +1,77 @@
+import hashlib
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Dict, Hashable, Optional
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.config import settings
-from app.database import get_db
+from app.database import get_async_db
 from app.models.user import User
 
 security = HTTPBearer()
 
 
+class _ExpiringCache:
+    # 按 LRU 淘汰、每个条目带过期时间（time.time() 时间戳）的缓存
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class CurrentUser:
+    # 缓存的用户信息快照，属性与 User 模型一致（不含密码哈希），不绑定数据库会话
+    __slots__ = ("id", "username", "email", "color", "created_at", "updated_at")
+
+    def __init__(self, user: User):
+        for name in self.__slots__:
+            setattr(self, name, getattr(user, name))
+
+
+# 已验证令牌的载荷，按令牌的 SHA-256 摘要缓存到令牌过期为止
+token_cache = _ExpiringCache(settings.TOKEN_CACHE_MAX_ENTRIES)
+user_cache = _ExpiringCache(settings.USER_CACHE_MAX_ENTRIES)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target: User):
+    user_cache.invalidate(target.id)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -24,41 +85,59 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 
 
 def verify_token(token: str) -> Optional[dict]:
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+    payload = token_cache.get(digest)
+    if payload is not None:
+        return payload
+    
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return payload
     except JWTError:
         return None
+    
+    if isinstance(payload.get("exp"), (int, float)):
+        token_cache.put(digest, payload, payload["exp"])
+    return payload
+
+
+def _credentials_exception(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+async def load_user(db: AsyncSession, user_id: int) -> Optional[CurrentUser]:
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    
+    record = await db.scalar(select(User).filter(User.id == user_id))
+    if record is None:
+        return None
+    user = CurrentUser(record)
+    user_cache.put(user_id, user, time.time() + settings.USER_CACHE_TTL)
+    return user
 
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)) -> User:
-    token = credentials.credentials
-    payload = verify_token(token)
+async def get_current_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -> int:
+    # 只需要用户 id 的接口使用该依赖：只验证令牌（通常命中缓存），不访问数据库
+    payload = verify_token(credentials.credentials)
     
     if payload is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="无效的认证令牌",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        raise _credentials_exception("无效的认证令牌")
     
     user_id: int = payload.get("user_id")
     if user_id is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="无效的认证令牌",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        raise _credentials_exception("无效的认证令牌")
     
-    user = db.query(User).filter(User.id == user_id).first()
+    return user_id
+
+
+async def get_current_user(user_id: int = Depends(get_current_user_id), db: AsyncSession = Depends(get_async_db)) -> CurrentUser:
+    user = await load_user(db, user_id)
     if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="用户不存在",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        raise _credentials_exception("用户不存在")
     
     return user
-
-
-
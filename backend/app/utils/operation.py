@@ -1,57 +1,82 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple, Union
+from app.utils.rope import Rope
 
+# 操作既可以作用在普通字符串上（返回新字符串），也可以作用在 Rope 上（原地修改并返回同一个 Rope）
+Content = Union[str, Rope]
 
-def apply_insert(content: str, from_pos: int, to_pos: int, insert_content: str) -> str:
+
+def _splice(content: Content, from_pos: int, to_pos: int, text: str) -> Content:
+    if isinstance(content, Rope):
+        content.replace(from_pos, to_pos, text)
+        return content
+    return content[:from_pos] + text + content[to_pos:]
+
+
+def apply_insert(content: Content, from_pos: int, to_pos: int, insert_content: str) -> Content:
     if from_pos != to_pos:
         raise ValueError("insert 操作的 from_pos 和 to_pos 必须相等")
     if from_pos > len(content):
         raise ValueError(f"插入位置 {from_pos} 超出文档长度 {len(content)}")
-    return content[:from_pos] + insert_content + content[from_pos:]
+    return _splice(content, from_pos, from_pos, insert_content)
 
 
-def apply_delete(content: str, from_pos: int, to_pos: int) -> str:
+def apply_delete(content: Content, from_pos: int, to_pos: int) -> Content:
     if from_pos >= to_pos:
         raise ValueError("delete 操作的 from_pos 必须小于 to_pos")
     if to_pos > len(content):
         raise ValueError(f"删除位置 {to_pos} 超出文档长度 {len(content)}")
-    return content[:from_pos] + content[to_pos:]
+    return _splice(content, from_pos, to_pos, "")
+
+
+# 格式化标记，按应用顺序排列：先加的标记在内层
+FORMAT_MARKERS = (("bold", "**"), ("italic", "*"), ("code", "`"))
+
+# 格式化实际做出的修改：(from_pos, to_pos, 插入的文本)，按顺序依次应用
+FormatEdit = Tuple[int, int, str]
 
 
-def apply_format(content: str, from_pos: int, to_pos: int, marks: Dict[str, Any]) -> str:
+def format_selection(selected_text: str, marks: Dict[str, Any]) -> Tuple[str, List[FormatEdit]]:
+    # 返回格式化后的文本，以及与之等价的逐步增删（位置相对于选中文本的起点）。
+    # 加标记是在两侧各插入一次，去标记会删除选中文本中所有的标记
+    edits: List[FormatEdit] = []
+    for mark, marker in FORMAT_MARKERS:
+        if mark not in marks:
+            continue
+        if marks[mark]:
+            edits.append((len(selected_text), len(selected_text), marker))
+            edits.append((0, 0, marker))
+            selected_text = f"{marker}{selected_text}{marker}"
+        else:
+            # 与 str.replace 一样从左到右匹配不重叠的标记，从后往前删除时前面的位置不受影响
+            starts = []
+            index = selected_text.find(marker)
+            while index != -1:
+                starts.append(index)
+                index = selected_text.find(marker, index + len(marker))
+            edits.extend((start, start + len(marker), "") for start in reversed(starts))
+            selected_text = selected_text.replace(marker, "")
+    return selected_text, edits
+
+
+def apply_format(content: Content, from_pos: int, to_pos: int, marks: Dict[str, Any]) -> Content:
     if from_pos >= to_pos:
         raise ValueError("format 操作的 from_pos 必须小于 to_pos")
     if to_pos > len(content):
         raise ValueError(f"格式化位置 {to_pos} 超出文档长度 {len(content)}")
     
-    selected_text = content[from_pos:to_pos]
-    
-    if "bold" in marks and marks["bold"]:
-        selected_text = f"**{selected_text}**"
-    elif "bold" in marks and not marks["bold"]:
-        selected_text = selected_text.replace("**", "")
-    
-    if "italic" in marks and marks["italic"]:
-        selected_text = f"*{selected_text}*"
-    elif "italic" in marks and not marks["italic"]:
-        selected_text = selected_text.replace("*", "")
-    
-    if "code" in marks and marks["code"]:
-        selected_text = f"`{selected_text}`"
-    elif "code" in marks and not marks["code"]:
-        selected_text = selected_text.replace("`", "")
-    
-    return content[:from_pos] + selected_text + content[to_pos:]
+    selected_text, _ = format_selection(content[from_pos:to_pos], marks)
+    return _splice(content, from_pos, to_pos, selected_text)
 
 
-def apply_replace(content: str, from_pos: int, to_pos: int, replace_content: str) -> str:
+def apply_replace(content: Content, from_pos: int, to_pos: int, replace_content: str) -> Content:
     if from_pos >= to_pos:
         raise ValueError("replace 操作的 from_pos 必须小于 to_pos")
     if to_pos > len(content):
         raise ValueError(f"替换位置 {to_pos} 超出文档长度 {len(content)}")
-    return content[:from_pos] + replace_content + content[to_pos:]
+    return _splice(content, from_pos, to_pos, replace_content)
 
 
-def apply_operation(content: str, operation: Dict[str, Any]) -> str:
+def apply_operation(content: Content, operation: Dict[str, Any]) -> Content:
     op_type = operation["type"]
     from_pos = operation["from_pos"]
     to_pos = operation["to_pos"]
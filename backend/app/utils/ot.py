@@ -0,0 +1,220 @@
+from typing import Any, Dict, List, Optional, Tuple
+from app.utils.operation import FORMAT_MARKERS
+
+Operation = Dict[str, Any]
+
+
+def _span(operation: Operation) -> Tuple[int, int, int]:
+    # 把所有操作统一看作“把 [from_pos, to_pos) 替换为长度为 n 的文本”
+    from_pos, to_pos = operation["from_pos"], operation["to_pos"]
+    op_type = operation["type"]
+    if op_type == "insert":
+        return from_pos, from_pos, len(operation.get("content") or "")
+    if op_type == "delete":
+        return from_pos, to_pos, 0
+    return from_pos, to_pos, len(operation.get("content") or "")
+
+
+def _with_range(operation: Operation, from_pos: int, to_pos: int) -> Operation:
+    return {**operation, "from_pos": from_pos, "to_pos": to_pos}
+
+
+def _delete(operation: Operation, from_pos: int, to_pos: int) -> Operation:
+    return {**operation, "type": "delete", "from_pos": from_pos, "to_pos": to_pos, "content": None, "marks": None}
+
+
+def _insert(operation: Operation, pos: int) -> Operation:
+    return {**operation, "type": "insert", "from_pos": pos, "to_pos": pos, "marks": None}
+
+
+def transform(operation: Operation, applied: Operation, applied_first: bool = True) -> List[Operation]:
+    # 把 operation 变换为在 applied 之后应用的等价操作。
+    # 返回的操作按位置从后往前排列且互不重叠，依次应用时互不影响；操作被完全吞没时返回空列表。
+    # applied_first 决定两个插入落在同一位置时谁在前，两个格式化范围的端点重合时 applied 在内层
+    if applied["type"] == "format":
+        return _transform_against_format(operation, applied, applied_first)
+
+    b1, b2, inserted = _span(applied)
+    delta = inserted - (b2 - b1)
+    op_type = operation["type"]
+
+    if op_type == "insert":
+        pos = operation["from_pos"]
+        if b1 == b2:
+            if pos > b1 or (pos == b1 and applied_first):
+                pos += inserted
+        elif pos >= b2:
+            pos += delta
+        elif pos > b1:
+            pos = b1 + inserted
+        return [_insert(operation, pos)]
+
+    a1, a2 = operation["from_pos"], operation["to_pos"]
+
+    if b1 == b2:
+        if b1 <= a1:
+            return [_with_range(operation, a1 + inserted, a2 + inserted)]
+        if b1 >= a2:
+            return [operation]
+        # 对方在范围内部插入了文本：格式化把新文本包含进来，删除/替换则保留对方插入的文本
+        if op_type == "format":
+            return [_with_range(operation, a1, a2 + inserted)]
+        return [_delete(operation, b1 + inserted, a2 + inserted), _with_range(operation, a1, b1)]
+
+    # 对方替换/删除了一段范围：重叠部分已不存在，只保留两侧剩余的部分
+    left = (a1, min(a2, b1)) if a1 < b1 else None
+    right = (max(a1, b2) + delta, a2 + delta) if a2 > b2 else None
+
+    if op_type == "format":
+        if left is None and right is None:
+            return []
+        start = left[0] if left else right[0]
+        end = right[1] if right else left[1]
+        return [_with_range(operation, start, end)]
+
+    if op_type == "delete":
+        return [_delete(operation, *piece) for piece in (right, left) if piece]
+
+    # replace：新内容放在左侧剩余部分，右侧剩余部分删除。
+    # 整个范围被吞没时退化为插入，位置要与对方被本操作拆分时其新内容所在的一侧保持一致
+    if left is None and right is None:
+        if b1 < a1 or (a1 == b1 and a2 == b2 and applied_first):
+            return [_insert(operation, b1 + inserted)]
+        return [_insert(operation, b1)]
+    if left is None:
+        return [_with_range(operation, *right)]
+    if right is None:
+        return [_with_range(operation, *left)]
+    return [_delete(operation, *right), _with_range(operation, *left)]
+
+
+def _wrap_length(operation: Operation) -> Optional[int]:
+    # 只加标记的格式化等价于在范围两侧各插入一段等长的标记，返回一侧的长度；含去标记时返回 None
+    marks = operation.get("marks") or {}
+    length = 0
+    for mark, marker in FORMAT_MARKERS:
+        if mark in marks:
+            if not marks[mark]:
+                return None
+            length += len(marker)
+    return length
+
+
+def format_edits(operation: Operation) -> List[Operation]:
+    # 把应用时记录的实际修改（edits）还原为依次应用的插入/删除/替换操作
+    if "edits" not in operation:
+        raise ValueError("去除格式的操作缺少实际修改的记录，无法与其他操作合并")
+    edits = []
+    for from_pos, to_pos, text in operation["edits"]:
+        if from_pos == to_pos:
+            edits.append({"type": "insert", "from_pos": from_pos, "to_pos": to_pos, "content": text})
+        elif text:
+            edits.append({"type": "replace", "from_pos": from_pos, "to_pos": to_pos, "content": text})
+        else:
+            edits.append({"type": "delete", "from_pos": from_pos, "to_pos": to_pos})
+    return edits
+
+
+def _transform_against_format(operation: Operation, applied: Operation, applied_first: bool) -> List[Operation]:
+    # 只加标记的格式化在 [a1, a2) 两侧各插入 n 个字符：a1 之前不动，范围内部后移 n，a2 之后后移 2n。
+    # 与之对应，format 被其他操作变换时（见 transform）范围外的插入留在标记之外、
+    # 完整覆盖格式化范围的删除连同标记一起删除、部分重叠时保留标记
+    n = _wrap_length(applied)
+    if n is None:
+        # 去除标记的位置取决于原文；已应用的操作在 rebase_operations 中按记录的实际修改展开，不会走到这里
+        raise ValueError("去除格式的操作之后还有其他操作，无法与并发的修改合并")
+    a1, a2 = applied["from_pos"], applied["to_pos"]
+
+    def move(pos: int) -> int:
+        if pos <= a1:
+            return pos
+        if pos >= a2:
+            return pos + 2 * n
+        return pos + n
+
+    op_type = operation["type"]
+    if op_type == "insert":
+        return [_insert(operation, move(operation["from_pos"]))]
+
+    p, q = operation["from_pos"], operation["to_pos"]
+    if op_type == "format":
+        # 端点重合时由 applied_first 决定谁包在外层，两条路径的嵌套顺序保持一致
+        start = (a1 if applied_first else a1 + n) if p == a1 else move(p)
+        end = (a2 + 2 * n if applied_first else a2 + n) if q == a2 else move(q)
+        return [_with_range(operation, start, end)]
+
+    if q <= a1 or p >= a2:
+        return [_with_range(operation, move(p), move(q))]
+    if p <= a1 and q >= a2:
+        return [_with_range(operation, p, q + 2 * n)]
+
+    left = (p, a1) if p < a1 else None
+    middle = (max(p, a1) + n, min(q, a2) + n)
+    right = (a2 + 2 * n, q + 2 * n) if q > a2 else None
+    if op_type == "delete":
+        return [_delete(operation, *piece) for piece in (right, middle, left) if piece]
+
+    # replace：与 format 被变换时新内容所在的一侧保持一致
+    if left is not None:
+        return [_delete(operation, *middle), _with_range(operation, *left)]
+    if right is not None:
+        return [_with_range(operation, *right), _delete(operation, *middle)]
+    if p == a1:
+        return [_delete(operation, *middle), _insert(operation, a1)]
+    if q == a2:
+        return [_insert(operation, a2 + 2 * n), _delete(operation, *middle)]
+    return [_with_range(operation, *middle)]
+
+
+def transform_sequences(
+    operations: List[Operation],
+    applied: List[Operation],
+    need_applied: bool = True
+) -> Tuple[List[Operation], List[Operation]]:
+    # operations 与 applied 基于同一版本、各自按顺序应用。
+    # 返回 (operations', applied')：operations' 接在 applied 之后应用，applied' 接在 operations 之后应用，两条路径结果一致。
+    # need_applied 为 False 时不计算 applied'（返回空列表）：去除格式的新操作无法作为变换的依据，
+    # 但位于最后时不需要把 applied 变换到它之后
+    applied_out: List[Operation] = []
+    for applied_operation in applied:
+        applied_sequence = [applied_operation]
+        transformed: List[Operation] = []
+        for index, operation in enumerate(operations):
+            need_after = need_applied or index < len(operations) - 1
+            operation_sequence, applied_sequence = _transform_single(operation, applied_sequence, need_after)
+            transformed.extend(operation_sequence)
+        operations = transformed
+        applied_out.extend(applied_sequence)
+    return operations, applied_out
+
+
+def _transform_single(
+    operation: Operation,
+    applied: List[Operation],
+    need_applied: bool = True
+) -> Tuple[List[Operation], List[Operation]]:
+    operations = [operation]
+    applied_out: List[Operation] = []
+    for applied_operation in applied:
+        if len(operations) == 1:
+            transformed = transform(operations[0], applied_operation, applied_first=True)
+            if need_applied:
+                applied_out.extend(transform(applied_operation, operations[0], applied_first=False))
+        else:
+            transformed, applied_after = transform_sequences(operations, [applied_operation], need_applied)
+            applied_out.extend(applied_after)
+        operations = transformed
+    return operations, applied_out
+
+
+def rebase_operations(operations: List[Operation], history: List[Operation]) -> List[Operation]:
+    # 把基于旧版本的一组连续操作变换到 history 全部应用之后的版本上。
+    # history 中去除格式的操作按应用时记录的实际修改展开；新操作中去除格式的操作之后还有其他操作时无法变换，抛出 ValueError
+    expanded: List[Operation] = []
+    for operation in history:
+        if operation["type"] == "format" and _wrap_length(operation) is None:
+            expanded.extend(format_edits(operation))
+        else:
+            expanded.append(operation)
+    rebased, _ = transform_sequences(operations, expanded, need_applied=False)
+    return rebased
@@ -1,10 +1,26 @@
+import asyncio
 import bcrypt
 import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, TypeVar
+from app.config import settings
+
+T = TypeVar("T")
+
+
+def _password_bytes(password: str) -> bytes:
+    # bcrypt 只使用前 72 字节，更长的密码先做 SHA-256；哈希与校验必须使用相同的处理
+    password_bytes = password.encode('utf-8')
+    if len(password_bytes) > 72:
+        password_bytes = hashlib.sha256(password_bytes).digest()
+    return password_bytes
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     try:
         return bcrypt.checkpw(
-            plain_password.encode('utf-8'),
+            _password_bytes(plain_password),
             hashed_password.encode('utf-8')
         )
     except Exception as e:
@@ -14,15 +30,80 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     try:
-        password_bytes = password.encode('utf-8')
-        if len(password_bytes) > 72:
-            password_bytes = hashlib.sha256(password_bytes).digest()
-        salt = bcrypt.gensalt(rounds=12)
-        hashed = bcrypt.hashpw(password_bytes, salt)
+        salt = bcrypt.gensalt(rounds=settings.PASSWORD_HASH_ROUNDS)
+        hashed = bcrypt.hashpw(_password_bytes(password), salt)
         return hashed.decode('utf-8')
     except Exception as e:
         print(f"Password hashing error: {e}")
         raise
 
 
+def needs_rehash(hashed_password: str) -> bool:
+    # bcrypt 哈希格式为 $2b$<cost>$...
+    try:
+        return int(hashed_password.split("$")[2]) != settings.PASSWORD_HASH_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    # bcrypt 每次计算需要数百毫秒，放在专用线程池中执行（bcrypt 计算时释放 GIL），不阻塞事件循环。
+    # 同时计算的数量受线程数限制，排队的请求数超过上限时直接拒绝，避免登录高峰堆积请求
+    def __init__(self, workers: int, max_pending: int):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.workers = workers
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._submit(verify_password, plain_password, hashed_password)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "peak_pending": self.peak_pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.wait_seconds / self.completed * 1000, 2) if self.completed else 0,
+            "avg_run_ms": round(self.run_seconds / self.completed * 1000, 2) if self.completed else 0,
+        }
+
+    async def _submit(self, func: Callable[..., T], *args) -> T:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordHasherBusy("密码哈希队列已满")
+
+        submitted = time.monotonic()
+
+        def run():
+            started = time.monotonic()
+            result = func(*args)
+            return result, started - submitted, time.monotonic() - started
+
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        try:
+            result, waited, ran = await asyncio.get_running_loop().run_in_executor(self._executor, run)
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        self.wait_seconds += waited
+        self.run_seconds += ran
+        return result
+
 
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_PENDING)
@@ -1,22 +1,109 @@
-from sqlalchemy.orm import Session
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
 from app.models.document import Document
 from app.models.document_share import DocumentShare, PermissionType
+from app.websocket.manager import manager
 
+# 缓存键：(文档, 用户) 对应该用户的权限（None 表示无权访问）；(文档, None) 对应文档所有者
+CacheKey = Tuple[int, Optional[int]]
 
-def has_document_access(db: Session, document_id: int, user_id: int, required_permission: PermissionType = PermissionType.READ) -> bool:
-    document = db.query(Document).filter(Document.id == document_id).first()
-    if not document:
-        return False
+_MISSING = object()
+
+
+class PermissionCache:
+    # 权限判断发生在每个请求和每条 WebSocket 消息上，结果按 LRU + TTL 缓存在进程内。
+    # 分享、取消分享和删除文档时显式失效；不存在的文档不缓存，避免文档创建后仍被判为不存在
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[CacheKey, Tuple[float, object]]" = OrderedDict()
+        self._keys_by_document: Dict[int, Set[CacheKey]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: CacheKey):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return _MISSING
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: CacheKey, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        self._keys_by_document.setdefault(key[0], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest, _ = next(iter(self._entries.items()))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, document_id: int, user_id: Optional[int] = None):
+        # 只给出文档时清除该文档的所有条目（包括所有者）
+        if user_id is not None:
+            self._remove((document_id, user_id))
+            return
+        for key in list(self._keys_by_document.get(document_id, ())):
+            self._remove(key)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, key: CacheKey):
+        if self._entries.pop(key, None) is None:
+            return
+        keys = self._keys_by_document.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_document[key[0]]
+
+
+permission_cache = PermissionCache(settings.PERMISSION_CACHE_MAX_ENTRIES, settings.PERMISSION_CACHE_TTL)
+
+
+async def resolve_permission(db: AsyncSession, document_id: int, user_id: int) -> Optional[PermissionType]:
+    # 返回用户对文档的权限，文档不存在或无权访问时返回 None
+    permission = permission_cache.get((document_id, user_id))
+    if permission is not _MISSING:
+        return permission
     
-    if document.owner_id == user_id:
-        return True
+    owner_id = permission_cache.get((document_id, None))
+    if owner_id is _MISSING:
+        owner_id = await db.scalar(select(Document.owner_id).filter(Document.id == document_id))
+        if owner_id is None:
+            return None
+        permission_cache.put((document_id, None), owner_id)
     
-    share = db.query(DocumentShare).filter(
-        DocumentShare.document_id == document_id,
-        DocumentShare.user_id == user_id
-    ).first()
+    if owner_id == user_id:
+        permission = PermissionType.ADMIN
+    else:
+        permission = await db.scalar(select(DocumentShare.permission).filter(
+            DocumentShare.document_id == document_id,
+            DocumentShare.user_id == user_id
+        ))
     
-    if not share:
+    permission_cache.put((document_id, user_id), permission)
+    return permission
+
+
+async def has_document_access(db: AsyncSession, document_id: int, user_id: int, required_permission: PermissionType = PermissionType.READ) -> bool:
+    permission = await resolve_permission(db, document_id, user_id)
+    if permission is None:
         return False
     
     permission_levels = {
@@ -25,41 +112,38 @@ def has_document_access(db: Session, document_id: int, user_id: int, required_pe
         PermissionType.ADMIN: 3
     }
     
-    user_permission_level = permission_levels.get(share.permission, 0)
+    user_permission_level = permission_levels.get(permission, 0)
     required_level = permission_levels.get(required_permission, 0)
     
     return user_permission_level >= required_level
 
 
-def get_user_documents_query(db: Session, user_id: int):
-    from sqlalchemy import or_
-    return db.query(Document).filter(
+def revoke_access(document_id: int, user_id: Optional[int] = None):
+    # 取消分享或删除文档后调用：清除权限缓存，并撤销仍订阅该文档的 WebSocket 连接（包括其他 worker 上的）
+    permission_cache.invalidate(document_id, user_id)
+    manager.revoke_access(document_id, user_id)
+
+
+def get_user_documents_query(user_id: int):
+    # 一次查询得到用户拥有或被分享的文档，以及分享给该用户的权限（自己拥有的文档为 NULL）
+    return select(Document, DocumentShare.permission.label("share_permission")).outerjoin(
+        DocumentShare,
+        and_(
+            DocumentShare.document_id == Document.id,
+            DocumentShare.user_id == user_id
+        )
+    ).filter(
         or_(
             Document.owner_id == user_id,
-            Document.id.in_(
-                db.query(DocumentShare.document_id).filter(
-                    DocumentShare.user_id == user_id
-                )
-            )
+            DocumentShare.id.isnot(None)
         )
     )
 
 
-def get_user_permission(db: Session, document_id: int, user_id: int) -> PermissionType:
-    document = db.query(Document).filter(Document.id == document_id).first()
-    if not document:
-        return PermissionType.READ
-    
-    if document.owner_id == user_id:
-        return PermissionType.ADMIN
-    
-    share = db.query(DocumentShare).filter(
-        DocumentShare.document_id == document_id,
-        DocumentShare.user_id == user_id
-    ).first()
-    
-    if not share:
+async def get_user_permission(db: AsyncSession, document_id: int, user_id: int) -> PermissionType:
+    permission = await resolve_permission(db, document_id, user_id)
+    if permission is None:
         return PermissionType.READ
     
-    return share.permission
+    return permission
 
@@ -0,0 +1,170 @@
+import random
+from typing import List, Optional, Tuple
+
+# 单个叶子节点保存的最大字符数，插入时在此范围内直接原地修改节点文本
+MAX_CHUNK_SIZE = 1024
+# 节点碎片过多时整体重建，保证节点数与文档长度成比例
+REBUILD_SLACK = 64
+
+
+class _Node:
+    __slots__ = ("text", "priority", "left", "right", "size", "count")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.priority = random.random()
+        self.left: Optional["_Node"] = None
+        self.right: Optional["_Node"] = None
+        self.size = len(text)  # 子树中的字符总数
+        self.count = 1  # 子树中的节点总数
+
+
+def _size(node: Optional[_Node]) -> int:
+    return node.size if node is not None else 0
+
+
+def _count(node: Optional[_Node]) -> int:
+    return node.count if node is not None else 0
+
+
+def _update(node: _Node) -> _Node:
+    node.size = _size(node.left) + len(node.text) + _size(node.right)
+    node.count = _count(node.left) + 1 + _count(node.right)
+    return node
+
+
+def _merge(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return _update(left)
+    right.left = _merge(left, right.left)
+    return _update(right)
+
+
+def _split(node: Optional[_Node], pos: int) -> Tuple[Optional[_Node], Optional[_Node]]:
+    # 按字符位置切分为 [0, pos) 与 [pos, size)，必要时把一个叶子的文本一分为二
+    if node is None:
+        return None, None
+    left_size = _size(node.left)
+    if pos <= left_size:
+        left, node.left = _split(node.left, pos)
+        return left, _update(node)
+    offset = pos - left_size
+    if offset >= len(node.text):
+        node.right, right = _split(node.right, offset - len(node.text))
+        return _update(node), right
+    tail = _Node(node.text[offset:])
+    tail.priority = node.priority
+    node.text = node.text[:offset]
+    tail.right = node.right
+    node.right = None
+    return _update(node), _update(tail)
+
+
+def _insert_in_place(node: Optional[_Node], pos: int, text: str) -> bool:
+    # 插入点所在叶子还有空间时直接修改该叶子，避免逐字输入时产生大量碎片节点
+    if node is None:
+        return False
+    left_size = _size(node.left)
+    if pos < left_size:
+        done = _insert_in_place(node.left, pos, text)
+    elif pos <= left_size + len(node.text):
+        if len(node.text) + len(text) > MAX_CHUNK_SIZE:
+            return False
+        offset = pos - left_size
+        node.text = node.text[:offset] + text + node.text[offset:]
+        done = True
+    else:
+        done = _insert_in_place(node.right, pos - left_size - len(node.text), text)
+    if done:
+        node.size += len(text)
+    return done
+
+
+def _build(text: str) -> Optional[_Node]:
+    root = None
+    for start in range(0, len(text), MAX_CHUNK_SIZE):
+        root = _merge(root, _Node(text[start:start + MAX_CHUNK_SIZE]))
+    return root
+
+
+def _collect(node: Optional[_Node], start: int, stop: int, parts: List[str]):
+    if node is None or start >= stop:
+        return
+    left_size = _size(node.left)
+    if start < left_size:
+        _collect(node.left, start, min(stop, left_size), parts)
+    text_end = left_size + len(node.text)
+    if start < text_end and stop > left_size:
+        parts.append(node.text[max(start - left_size, 0):min(stop, text_end) - left_size])
+    if stop > text_end:
+        _collect(node.right, max(start - text_end, 0), stop - text_end, parts)
+
+
+class Rope:
+    # 基于隐式 treap 的文本缓冲区，插入/删除/替换的代价为 O(log n)，
+    # 完整字符串只在真正需要时拼接一次并缓存到下次修改
+    def __init__(self, text: str = ""):
+        self._root = _build(text)
+        self._text: Optional[str] = text
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def __str__(self) -> str:
+        if self._text is None:
+            self._text = self.substring(0, len(self))
+        return self._text
+
+    def __getitem__(self, key) -> str:
+        if not isinstance(key, slice):
+            raise TypeError("Rope 只支持切片访问")
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError("Rope 切片不支持步长")
+        return self.substring(start, stop)
+
+    def substring(self, start: int, stop: int) -> str:
+        if self._text is not None:
+            return self._text[start:stop]
+        parts: List[str] = []
+        _collect(self._root, start, stop, parts)
+        return "".join(parts)
+
+    def insert(self, pos: int, text: str):
+        if not text:
+            return
+        self._text = None
+        if not _insert_in_place(self._root, pos, text):
+            left, right = _split(self._root, pos)
+            self._root = _merge(_merge(left, _build(text)), right)
+            self._compact_if_fragmented()
+
+    def delete(self, start: int, stop: int):
+        if start >= stop:
+            return
+        self._text = None
+        left, rest = _split(self._root, start)
+        _, right = _split(rest, stop - start)
+        self._root = _merge(left, right)
+        self._compact_if_fragmented()
+
+    def replace(self, start: int, stop: int, text: str):
+        if start == stop:
+            self.insert(start, text)
+            return
+        self._text = None
+        left, rest = _split(self._root, start)
+        _, right = _split(rest, stop - start)
+        self._root = _merge(_merge(left, _build(text)), right)
+        self._compact_if_fragmented()
+
+    def _compact_if_fragmented(self):
+        # 节点数超过理想值的两倍时重建，重建代价 O(n)，但摊还到每次编辑上是常数
+        if _count(self._root) > 2 * (len(self) // MAX_CHUNK_SIZE) + REBUILD_SLACK:
+            text = str(self)
+            self._root = _build(text)
@@ -0,0 +1,77 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+from app.config import settings
+
+Job = Callable[[], Awaitable[Any]]
+
+
+class SequencerBusy(Exception):
+    pass
+
+
+class _DocumentActor:
+    def __init__(self):
+        self.queue: Deque[Tuple[Job, asyncio.Future]] = deque()
+        self.wakeup = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        self.task: Optional[asyncio.Task] = None
+
+
+class DocumentSequencer:
+    # 每个文档一个单写者 actor：提交到同一文档的任务严格按顺序逐个执行，不同文档之间互不阻塞。
+    # actor 空闲一段时间后自动退出，队列长度超过上限时拒绝新任务
+    def __init__(self, max_queue_depth: int, idle_timeout: float):
+        self.max_queue_depth = max_queue_depth
+        self.idle_timeout = idle_timeout
+        self._actors: Dict[int, _DocumentActor] = {}
+
+    async def submit(self, document_id: int, job: Job, bypass_limit: bool = False) -> Any:
+        actor = self._actors.get(document_id)
+        if actor is None or actor.loop is not asyncio.get_running_loop():
+            # actor 绑定在创建它的事件循环上，事件循环更换后（例如应用重启）重新创建
+            actor = self._actors[document_id] = _DocumentActor()
+            actor.task = asyncio.create_task(self._run(document_id, actor))
+        elif not bypass_limit and len(actor.queue) >= self.max_queue_depth:
+            raise SequencerBusy(f"文档 {document_id} 的编辑队列已满")
+
+        future = asyncio.get_running_loop().create_future()
+        actor.queue.append((job, future))
+        actor.wakeup.set()
+        return await future
+
+    def active_documents(self) -> Set[int]:
+        return set(self._actors)
+
+    def queue_depth(self, document_id: int) -> int:
+        actor = self._actors.get(document_id)
+        return len(actor.queue) if actor is not None else 0
+
+    async def _run(self, document_id: int, actor: _DocumentActor):
+        while True:
+            if not actor.queue:
+                actor.wakeup.clear()
+                try:
+                    await asyncio.wait_for(actor.wakeup.wait(), timeout=self.idle_timeout)
+                except asyncio.TimeoutError:
+                    if not actor.queue:
+                        if self._actors.get(document_id) is actor:
+                            del self._actors[document_id]
+                        return
+                    continue
+
+            job, future = actor.queue.popleft()
+            if future.cancelled():
+                # 提交方已经放弃（例如请求被取消），不再执行
+                continue
+            try:
+                result = await job()
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+
+document_sequencer = DocumentSequencer(settings.SEQUENCER_MAX_QUEUE_DEPTH, settings.SEQUENCER_IDLE_TIMEOUT)
@@ -0,0 +1,296 @@
+import asyncio
+import errno
+import json
+import os
+import socket
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Set
+from app.config import settings
+
+# 收到其他进程转发的广播后交给本地连接：(document_id, message, exclude_user_id, coalesce_key, exclude_connection_id)
+Deliver = Callable[[int, Dict[str, Any], Optional[int], Optional[str], Optional[str]], None]
+
+# 内核为每个 Unix 数据报额外占用的发送缓冲区字节数：能发送的最大数据报是 SO_SNDBUF 减去这部分
+_DATAGRAM_OVERHEAD = 32
+# 对端接收缓冲区已满时，隔多久重试发送积压的重新同步通知（秒）
+_RETRY_DELAY = 0.05
+
+
+class Backplane:
+    # 跨进程/跨节点的广播通道。ConnectionManager 先把消息发给本地连接，再通过 backplane 发布给其他进程；
+    # 每个进程只订阅本地有连接的文档，也只会收到这些文档的消息
+    async def start(self, deliver: Deliver):
+        raise NotImplementedError
+
+    async def stop(self):
+        raise NotImplementedError
+
+    def subscribe(self, document_id: int):
+        raise NotImplementedError
+
+    def unsubscribe(self, document_id: int):
+        raise NotImplementedError
+
+    def publish(
+        self,
+        document_id: int,
+        message: Dict[str, Any],
+        exclude_user_id: Optional[int],
+        coalesce_key: Optional[str],
+        exclude_connection_id: Optional[str] = None
+    ):
+        raise NotImplementedError
+
+
+class InProcessBackplane(Backplane):
+    # 同一进程内多个 ConnectionManager 之间转发，单 worker 部署时不做任何额外工作，也便于在测试中模拟多个 worker
+    def __init__(self, hub: Optional[List["InProcessBackplane"]] = None):
+        self.hub = hub if hub is not None else []
+        self.subscriptions: Set[int] = set()
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+        self.hub.append(self)
+
+    async def stop(self):
+        if self in self.hub:
+            self.hub.remove(self)
+        self.subscriptions.clear()
+
+    def subscribe(self, document_id: int):
+        self.subscriptions.add(document_id)
+
+    def unsubscribe(self, document_id: int):
+        self.subscriptions.discard(document_id)
+
+    def publish(
+        self,
+        document_id: int,
+        message: Dict[str, Any],
+        exclude_user_id: Optional[int],
+        coalesce_key: Optional[str],
+        exclude_connection_id: Optional[str] = None
+    ):
+        for member in self.hub:
+            if member is not self and document_id in member.subscriptions:
+                member._deliver(document_id, message, exclude_user_id, coalesce_key, exclude_connection_id)
+
+
+class UnixSocketBackplane(Backplane):
+    # 同一台机器上的多个 worker 通过 Unix 数据报套接字直接互相转发，无需外部服务。
+    # 每个 worker 在 BACKPLANE_SOCKET_DIR 下绑定一个套接字，启动时向已有的 worker 发送 hello 交换订阅关系，
+    # 之后订阅变化通过控制消息同步，广播只发给订阅了该文档的 worker
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock")
+        self.subscriptions: Set[int] = set()
+        self._peers: Dict[str, Set[int]] = {}
+        self._sock: Optional[socket.socket] = None
+        self._deliver: Optional[Deliver] = None
+        self._max_datagram_size = 0
+        self._recv_buffer = bytearray()
+        # 发送失败、等待重试的数据报：对端 -> 按发送顺序去重的数据报
+        self._retries: Dict[str, Dict[bytes, None]] = {}
+        self._retry_handle: Optional[asyncio.TimerHandle] = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+        os.makedirs(self.directory, exist_ok=True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(self.path)
+        sock.setblocking(False)
+        # 默认缓冲区（net.core.wmem_default，通常约 208KB）限制了单个数据报的大小；
+        # 内核会按 wmem_max/rmem_max 截断设置的值，实际可发送的大小以读回的值为准
+        for option in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, option, settings.BACKPLANE_BUFFER_SIZE)
+            except OSError:
+                pass
+        self._max_datagram_size = sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) - _DATAGRAM_OVERHEAD
+        # 各 worker 使用相同的配置，按本进程能发送的最大数据报预先分配接收缓冲区，避免每次接收都分配
+        self._recv_buffer = bytearray(self._max_datagram_size)
+        self._sock = sock
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._on_readable)
+
+        hello = self._encode({"kind": "hello", "documents": sorted(self.subscriptions)})
+        for name in os.listdir(self.directory):
+            peer = os.path.join(self.directory, name)
+            if name.endswith(".sock") and peer != self.path:
+                self._peers[peer] = set()
+                self._send_in_order(peer, hello)
+
+    async def stop(self):
+        if self._sock is None:
+            return
+        bye = self._encode({"kind": "bye"})
+        for peer in list(self._peers):
+            self._send(peer, bye)
+        asyncio.get_running_loop().remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+        self._peers.clear()
+        self._retries.clear()
+        if self._retry_handle is not None:
+            self._retry_handle.cancel()
+            self._retry_handle = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def subscribe(self, document_id: int):
+        if document_id not in self.subscriptions:
+            self.subscriptions.add(document_id)
+            self._send_all({"kind": "subscribe", "document_id": document_id})
+
+    def unsubscribe(self, document_id: int):
+        if document_id in self.subscriptions:
+            self.subscriptions.discard(document_id)
+            self._send_all({"kind": "unsubscribe", "document_id": document_id})
+
+    def publish(
+        self,
+        document_id: int,
+        message: Dict[str, Any],
+        exclude_user_id: Optional[int],
+        coalesce_key: Optional[str],
+        exclude_connection_id: Optional[str] = None
+    ):
+        peers = [peer for peer, documents in self._peers.items() if document_id in documents]
+        if not peers:
+            return
+        data = self._encode({
+            "kind": "message",
+            "document_id": document_id,
+            "message": message,
+            "exclude_user_id": exclude_user_id,
+            "coalesce_key": coalesce_key,
+            "exclude_connection_id": exclude_connection_id
+        })
+        if len(data) > self._max_datagram_size:
+            # 消息过大无法用一个数据报发送，改为通知对方的客户端重新同步
+            data = self._resync_envelope(document_id)
+        for peer in peers:
+            if not self._send(peer, data):
+                # 对端接收缓冲区已满：消息本身不再补发（顺序已无法保证），积压一条重新同步通知稍后重试。
+                # 撤销访问权限的通知必须送达，原样重试
+                if message.get("type") != "access_revoked":
+                    self._queue_retry(peer, self._resync_envelope(document_id))
+                else:
+                    self._queue_retry(peer, data)
+
+    def _resync_envelope(self, document_id: int) -> bytes:
+        # 不排除任何连接：丢失的消息对发起者所在的连接本来就不可见，通知所有订阅者重新同步即可
+        return self._encode({
+            "kind": "message",
+            "document_id": document_id,
+            "message": {"type": "resync_required", "data": {"document_id": document_id}},
+            "exclude_user_id": None,
+            "coalesce_key": None,
+            "exclude_connection_id": None
+        })
+
+    def _send_in_order(self, peer: str, data: bytes):
+        # 订阅关系等控制消息必须按顺序送达：对端还有积压时排在积压之后，发送失败时加入积压
+        if peer in self._retries or not self._send(peer, data):
+            self._queue_retry(peer, data)
+
+    def _queue_retry(self, peer: str, data: bytes):
+        # 相同的数据报只保留最后一次的位置，例如积压中的 subscribe/unsubscribe/subscribe 不会被合并成先订阅后取消
+        pending = self._retries.setdefault(peer, {})
+        pending.pop(data, None)
+        pending[data] = None
+        self._schedule_retry()
+
+    def _schedule_retry(self):
+        if self._retry_handle is None and self._sock is not None:
+            self._retry_handle = asyncio.get_running_loop().call_later(_RETRY_DELAY, self._flush_retries)
+
+    def _flush_retries(self):
+        self._retry_handle = None
+        for peer in list(self._retries):
+            pending = self._retries[peer]
+            while pending:
+                data = next(iter(pending))
+                if not self._send(peer, data):
+                    break
+                pending.pop(data, None)
+            if not pending or peer not in self._peers:
+                self._retries.pop(peer, None)
+        if self._retries:
+            self._schedule_retry()
+
+    def _encode(self, envelope: Dict[str, Any]) -> bytes:
+        return json.dumps(envelope, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def _send_all(self, envelope: Dict[str, Any]):
+        data = self._encode(envelope)
+        for peer in list(self._peers):
+            self._send_in_order(peer, data)
+
+    def _send(self, peer: str, data: bytes) -> bool:
+        # 返回 False 表示对端接收缓冲区已满、数据报没有发出，由调用方决定如何重试
+        if self._sock is None:
+            return True
+        try:
+            self._sock.sendto(data, peer)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # 对方进程已退出：移除残留的套接字文件
+            self._peers.pop(peer, None)
+            self._retries.pop(peer, None)
+            try:
+                os.remove(peer)
+            except OSError:
+                pass
+        except BlockingIOError:
+            return False
+        except OSError as e:
+            if e.errno != errno.EMSGSIZE:
+                raise
+            # 发送前已按 SO_SNDBUF 检查过大小，正常不会发生；按缓冲区已满处理，由调用方改为重新同步
+            return False
+        return True
+
+    def _on_readable(self):
+        while self._sock is not None:
+            try:
+                size, peer = self._sock.recvfrom_into(self._recv_buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            try:
+                self._handle(json.loads(self._recv_buffer[:size]), peer)
+            except Exception as e:
+                print(f"backplane 消息处理失败: {e}")
+
+    def _handle(self, envelope: Dict[str, Any], peer: str):
+        kind = envelope.get("kind")
+        if kind == "message":
+            document_id = envelope["document_id"]
+            if document_id in self.subscriptions:
+                self._deliver(
+                    document_id,
+                    envelope["message"],
+                    envelope.get("exclude_user_id"),
+                    envelope.get("coalesce_key"),
+                    envelope.get("exclude_connection_id")
+                )
+        elif kind == "hello":
+            self._peers[peer] = set(envelope.get("documents", []))
+            self._send_in_order(peer, self._encode({"kind": "state", "documents": sorted(self.subscriptions)}))
+        elif kind == "state":
+            self._peers[peer] = set(envelope.get("documents", []))
+        elif kind == "subscribe":
+            self._peers.setdefault(peer, set()).add(envelope["document_id"])
+        elif kind == "unsubscribe":
+            self._peers.setdefault(peer, set()).discard(envelope["document_id"])
+        elif kind == "bye":
+            self._peers.pop(peer, None)
+
+
+def create_backplane() -> Backplane:
+    if settings.BACKPLANE == "inprocess":
+        return InProcessBackplane()
+    if settings.BACKPLANE == "unix":
+        return UnixSocketBackplane(settings.BACKPLANE_SOCKET_DIR)
+    raise ValueError(f"不支持的 backplane: {settings.BACKPLANE}")
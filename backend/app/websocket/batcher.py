@@ -0,0 +1,76 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+from app.config import settings
+from app.websocket.manager import ConnectionManager, manager
+
+
+class _Batch:
+    def __init__(self, deadline: float):
+        self.records: List[Tuple[Dict[str, Any], Optional[str]]] = []  # (操作记录, 提交该操作的 connection_id)
+        self.deadline = deadline  # 第一个操作加入后的最晚发送时间
+        self.last_added = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+
+class OperationBatcher:
+    # 批量广播模式：同一文档在短时间窗口内被接受的操作合并为一个按版本排序的 operations_applied 帧。
+    # 窗口内没有新操作超过 BROADCAST_BATCH_WINDOW 秒即发送，且距第一个操作最多等待 BROADCAST_BATCH_MAX_DELAY 秒。
+    # 一帧中可能包含多个用户、多个连接的操作，因此发给所有订阅者。每个操作带 user_id 和提交它的 connection_id，
+    # 客户端按 connection_id 跳过本连接提交的操作，同一用户其他标签页的操作照常应用；
+    # 通过 REST 提交且未带 X-Connection-Id 的操作 connection_id 为 null
+    def __init__(self, connections: ConnectionManager):
+        self.connections = connections
+        self._batches: Dict[int, _Batch] = {}
+
+    async def add(self, document_id: int, records: List[Dict[str, Any]], connection_id: Optional[str] = None):
+        loop = asyncio.get_running_loop()
+        batch = self._batches.get(document_id)
+        if batch is None:
+            batch = self._batches[document_id] = _Batch(loop.time() + settings.BROADCAST_BATCH_MAX_DELAY)
+            batch.task = asyncio.create_task(self._flush_later(document_id, batch))
+        batch.records.extend((record, connection_id) for record in records)
+        batch.last_added = loop.time()
+        if len(batch.records) >= settings.BROADCAST_BATCH_MAX_OPERATIONS:
+            await self.flush(document_id)
+
+    async def flush(self, document_id: int):
+        batch = self._batches.pop(document_id, None)
+        if batch is None or not batch.records:
+            return
+        entries = sorted(batch.records, key=lambda entry: entry[0]["version_before"])
+        await self.connections.broadcast_to_document({
+            "type": "operations_applied",
+            "data": {
+                "document_id": document_id,
+                "operations": [
+                    {
+                        **record["operation"],
+                        "version": record["version_after"],
+                        "user_id": record["user_id"],
+                        "connection_id": connection_id
+                    }
+                    for record, connection_id in entries
+                ],
+                "base_version": entries[0][0]["version_before"],
+                "version": entries[-1][0]["version_after"]
+            }
+        }, document_id)
+
+    async def stop(self):
+        for document_id in list(self._batches):
+            batch = self._batches.get(document_id)
+            if batch is not None and batch.task is not None:
+                batch.task.cancel()
+            await self.flush(document_id)
+
+    async def _flush_later(self, document_id: int, batch: _Batch):
+        loop = asyncio.get_running_loop()
+        while self._batches.get(document_id) is batch:
+            due = min(batch.last_added + settings.BROADCAST_BATCH_WINDOW, batch.deadline)
+            if loop.time() >= due:
+                await self.flush(document_id)
+                return
+            await asyncio.sleep(due - loop.time())
+
+
+operation_batcher = OperationBatcher(manager)
@@ -0,0 +1,97 @@
+import asyncio
+import math
+import time
+from typing import Dict, List, Optional, Set
+from fastapi import status
+from app.config import settings
+from app.websocket.manager import Connection, ConnectionManager, manager
+
+
+class HeartbeatScheduler:
+    # 由服务端检测连接是否存活：所有连接放在同一个时间轮中，只有一个后台任务，每隔 HEARTBEAT_TICK 秒处理到期的一格。
+    # 收到客户端消息时只更新 last_seen，不移动时间轮中的位置；到期检查时再按 last_seen 重新安排：
+    #   空闲超过 HEARTBEAT_INTERVAL：发送 ping，HEARTBEAT_TIMEOUT 秒后再检查
+    #   ping 之后仍没有任何消息：断开连接并从广播目标中移除
+    def __init__(self, connections: ConnectionManager):
+        self.connections = connections
+        self.pings_sent = 0
+        self.reaped = 0
+        self._wheel: List[Set[Connection]] = []
+        self._cursor = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, connection: Connection):
+        self._schedule(connection, settings.HEARTBEAT_INTERVAL)
+
+    async def start(self):
+        tick = settings.HEARTBEAT_TICK
+        # 最长的等待时间也要落在一圈之内
+        size = math.ceil(max(settings.HEARTBEAT_INTERVAL, settings.HEARTBEAT_TIMEOUT) / tick) + 2
+        self._wheel = [set() for _ in range(size)]
+        self._cursor = 0
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._wheel = []
+
+    def check(self):
+        # 处理当前一格中到期的连接
+        due, self._wheel[self._cursor] = self._wheel[self._cursor], set()
+        now = time.monotonic()
+        for connection in due:
+            if connection.closed:
+                continue
+            if connection.ping_sent_at is not None:
+                # ping 之后收到任何消息都会清除 ping_sent_at，走到这里说明客户端已无响应
+                self.reaped += 1
+                self.connections.disconnect(connection)
+                asyncio.create_task(connection.close(status.WS_1001_GOING_AWAY))
+                continue
+            idle = now - connection.last_seen
+            if idle >= settings.HEARTBEAT_INTERVAL:
+                connection.ping_sent_at = now
+                connection.send({"type": "ping"})
+                self.pings_sent += 1
+                self._schedule(connection, settings.HEARTBEAT_TIMEOUT)
+            else:
+                self._schedule(connection, settings.HEARTBEAT_INTERVAL - idle)
+
+    def stats(self) -> Dict[str, float]:
+        now = time.monotonic()
+        idle = [now - connection.last_seen for connection in self.connections.connections.values()]
+        return {
+            "connections": len(idle),
+            "documents": len(self.connections.active_connections),
+            "awaiting_pong": sum(
+                1 for connection in self.connections.connections.values() if connection.ping_sent_at is not None
+            ),
+            "idle_max": round(max(idle), 3) if idle else 0,
+            "idle_mean": round(sum(idle) / len(idle), 3) if idle else 0,
+            "pings_sent": self.pings_sent,
+            "reaped": self.reaped,
+        }
+
+    def _schedule(self, connection: Connection, delay: float):
+        if not self._wheel:
+            return
+        slots = min(max(1, math.ceil(delay / settings.HEARTBEAT_TICK)), len(self._wheel) - 1)
+        self._wheel[(self._cursor + slots) % len(self._wheel)].add(connection)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.HEARTBEAT_TICK)
+            self._cursor = (self._cursor + 1) % len(self._wheel)
+            try:
+                self.check()
+            except Exception as e:
+                print(f"心跳检测失败: {e}")
+
+
+heartbeat_scheduler = HeartbeatScheduler(manager)
@@ -1,61 +1,240 @@
-from typing import Dict, Set
-from fastapi import WebSocket
-import json
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Set, Tuple
+from fastapi import WebSocket, status
+from app.config import settings
+from app.websocket.protocol import Payload, json_codec
+from app.websocket.backplane import Backplane, create_backplane
+import asyncio
+import time
+import uuid
+
+
+class Connection:
+    # 一个客户端（浏览器）一个连接，可以同时订阅多个文档；同一用户的多个标签页各自拥有独立的连接和 connection_id。
+    # 每个连接一个有界发送队列和独立的写任务，慢客户端不会拖慢广播方和其他客户端。
+    # 队列满时按 WEBSOCKET_SLOW_CONSUMER_POLICY 处理：
+    #   drop：丢弃新消息，队列排空后通知客户端重新同步（catch_up）
+    #   coalesce：把积压的消息整体替换为重新同步通知
+    #   disconnect：断开连接
+    def __init__(self, websocket: WebSocket, user_id: int, codec=json_codec):
+        self.websocket = websocket
+        self.codec = codec
+        self.connection_id = uuid.uuid4().hex[:16]
+        self.user_id = user_id
+        self.documents: Dict[int, bool] = {}  # 已订阅的文档 -> 订阅时解析的是否可编辑
+        self.closed = False
+        self.last_seen = time.monotonic()  # 最后一次收到客户端消息的时间
+        self.ping_sent_at: Optional[float] = None
+        self._queue: Deque[Tuple[Optional[str], Payload, bool]] = deque()  # (合并键, 消息, 是否直接回复)
+        self._wakeup = asyncio.Event()
+        self._resync_documents: Set[int] = set()
+        self._writer: Optional[asyncio.Task] = None
+    
+    def start(self):
+        self._writer = asyncio.create_task(self._write())
+    
+    def touch(self):
+        self.last_seen = time.monotonic()
+        self.ping_sent_at = None
+    
+    def send(self, message: dict):
+        # 直接回复给该连接的消息（应答、错误等）不受队列上限限制，保证不丢失且与广播保持顺序
+        self.send_encoded(self.codec.encode(message))
+    
+    def send_encoded(self, payload: Payload):
+        self._push(None, payload, direct=True)
+    
+    def enqueue(self, document_id: int, payload: Payload, coalesce_key: Optional[str] = None) -> bool:
+        # 返回 False 表示连接已关闭或因过慢被断开
+        if self.closed:
+            return False
+        if coalesce_key is not None:
+            # 同一个键（例如同一文档的在线状态）只保留最新的一条
+            for index, (key, _, direct) in enumerate(self._queue):
+                if key == coalesce_key:
+                    self._queue[index] = (key, payload, direct)
+                    return True
+        if len(self._queue) < settings.WEBSOCKET_SEND_QUEUE_SIZE:
+            self._push(coalesce_key, payload)
+            return True
+        
+        policy = settings.WEBSOCKET_SLOW_CONSUMER_POLICY
+        if policy == "disconnect":
+            self.stop()
+            asyncio.create_task(self.close(status.WS_1013_TRY_AGAIN_LATER))
+            return False
+        if policy == "coalesce":
+            # 只丢弃积压的广播，直接回复（应答、错误、首次同步等）保留，等待应答的客户端不会因此挂起
+            self._queue = deque(entry for entry in self._queue if entry[2])
+            for subscribed_id in self.documents:
+                self._push(None, self._resync_message(subscribed_id))
+        else:
+            self._resync_documents.add(document_id)
+        return True
+    
+    async def close(self, code: int = status.WS_1000_NORMAL_CLOSURE):
+        self.stop()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+    
+    def stop(self):
+        self.closed = True
+        self._queue.clear()
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+    
+    def _push(self, key: Optional[str], payload: Payload, direct: bool = False):
+        if self.closed:
+            return
+        self._queue.append((key, payload, direct))
+        self._wakeup.set()
+    
+    def _resync_message(self, document_id: int) -> Payload:
+        return self.codec.encode({
+            "type": "resync_required",
+            "data": {
+                "document_id": document_id
+            }
+        })
+    
+    async def _write(self):
+        try:
+            while True:
+                if not self._queue:
+                    if self._resync_documents:
+                        for document_id in self._resync_documents:
+                            self._push(None, self._resync_message(document_id))
+                        self._resync_documents.clear()
+                        continue
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                _, payload, _ = self._queue.popleft()
+                if isinstance(payload, bytes):
+                    await self.websocket.send_bytes(payload)
+                else:
+                    await self.websocket.send_text(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"发送消息失败 (connection_id={self.connection_id}): {e}")
+            self.stop()
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, Dict[int, WebSocket]] = {}
+    def __init__(self, backplane: Optional[Backplane] = None):
+        self.active_connections: Dict[int, Dict[str, Connection]] = {}  # 文档 -> connection_id -> 连接
+        self.connections: Dict[str, Connection] = {}  # 所有连接，包括尚未订阅任何文档的
+        self.backplane = backplane if backplane is not None else create_backplane()
+        # 文档的访问权限被撤销时调用 (document_id, user_id)，user_id 为 None 表示所有用户；由 WebSocket 接口层设置
+        self.on_access_revoked: Optional[Callable[[int, Optional[int]], None]] = None
     
-    async def connect(self, websocket: WebSocket, document_id: int, user_id: int):
+    async def start(self):
+        await self.backplane.start(self._deliver)
+    
+    async def stop(self):
+        await self.backplane.stop()
+    
+    async def connect(self, websocket: WebSocket, user_id: int, codec=json_codec) -> Connection:
         await websocket.accept()
         
+        connection = Connection(websocket, user_id, codec)
+        connection.start()
+        self.connections[connection.connection_id] = connection
+        return connection
+    
+    def subscribe(self, connection: Connection, document_id: int, can_edit: bool):
         if document_id not in self.active_connections:
             self.active_connections[document_id] = {}
+            self.backplane.subscribe(document_id)
         
-        self.active_connections[document_id][user_id] = websocket
+        self.active_connections[document_id][connection.connection_id] = connection
+        connection.documents[document_id] = can_edit
+    
+    def unsubscribe(self, connection: Connection, document_id: int):
+        connection.documents.pop(document_id, None)
+        self._remove(connection, document_id)
     
-    def disconnect(self, document_id: int, user_id: int):
+    def disconnect(self, connection: Connection):
+        # 只停止发送并从广播目标中移除；connection.documents 保持不变，由连接的处理协程负责退订（在线状态、缓存固定等）
+        connection.stop()
+        self.connections.pop(connection.connection_id, None)
+        for document_id in connection.documents:
+            self._remove(connection, document_id)
+    
+    def _remove(self, connection: Connection, document_id: int):
         if document_id in self.active_connections:
-            if user_id in self.active_connections[document_id]:
-                del self.active_connections[document_id][user_id]
+            self.active_connections[document_id].pop(connection.connection_id, None)
             
             if not self.active_connections[document_id]:
                 del self.active_connections[document_id]
+                self.backplane.unsubscribe(document_id)
     
     async def send_personal_message(self, message: dict, document_id: int, user_id: int):
-        if document_id in self.active_connections:
-            if user_id in self.active_connections[document_id]:
-                websocket = self.active_connections[document_id][user_id]
-                try:
-                    await websocket.send_json(message)
-                except Exception as e:
-                    print(f"发送消息失败: {e}")
-    
-    async def broadcast_to_document(self, message: dict, document_id: int, exclude_user_id: int = None):
+        for connection in list(self.active_connections.get(document_id, {}).values()):
+            if connection.user_id == user_id:
+                connection.send(message)
+    
+    async def broadcast_to_document(
+        self,
+        message: dict,
+        document_id: int,
+        exclude_user_id: int = None,
+        coalesce_key: Optional[str] = None,
+        exclude_connection_id: Optional[str] = None
+    ):
+        # 先发给本进程的连接，再通过 backplane 转发给其他订阅了该文档的进程。
+        # exclude_connection_id 只排除发起操作的那个连接（同一用户的其他标签页仍会收到），exclude_user_id 排除该用户的所有连接
+        self._deliver(document_id, message, exclude_user_id, coalesce_key, exclude_connection_id)
+        self.backplane.publish(document_id, message, exclude_user_id, coalesce_key, exclude_connection_id)
+    
+    def revoke_access(self, document_id: int, user_id: Optional[int] = None):
+        # 取消分享或删除文档后调用：本进程和其他进程中该用户（user_id 为 None 时为所有用户）对该文档的订阅都会被撤销
+        message = {"type": "access_revoked", "data": {"document_id": document_id, "user_id": user_id}}
+        self._deliver(document_id, message, None, None)
+        self.backplane.publish(document_id, message, None, None)
+    
+    def _deliver(
+        self,
+        document_id: int,
+        message: dict,
+        exclude_user_id: Optional[int],
+        coalesce_key: Optional[str],
+        exclude_connection_id: Optional[str] = None
+    ):
+        if message.get("type") == "access_revoked":
+            # 控制消息，不直接转发给客户端
+            if self.on_access_revoked is not None:
+                self.on_access_revoked(document_id, message["data"]["user_id"])
+            return
+        
+        # 每种协议只编码一次，然后放入各连接的发送队列，不等待实际发送
         if document_id not in self.active_connections:
             return
         
-        disconnected_users = []
+        encoded: Dict[str, Payload] = {}
+        disconnected = []
         
-        for user_id, websocket in self.active_connections[document_id].items():
-            if exclude_user_id is not None and user_id == exclude_user_id:
+        for connection_id, connection in self.active_connections[document_id].items():
+            if connection_id == exclude_connection_id:
+                continue
+            if exclude_user_id is not None and connection.user_id == exclude_user_id:
                 continue
             
-            try:
-                await websocket.send_json(message)
-            except Exception as e:
-                print(f"广播消息失败 (user_id={user_id}): {e}")
-                disconnected_users.append(user_id)
+            codec = connection.codec
+            if codec.name not in encoded:
+                encoded[codec.name] = codec.encode(message)
+            if not connection.enqueue(document_id, encoded[codec.name], coalesce_key):
+                disconnected.append(connection)
         
-        for user_id in disconnected_users:
-            self.disconnect(document_id, user_id)
+        for connection in disconnected:
+            self.disconnect(connection)
     
     def get_subscribed_users(self, document_id: int) -> Set[int]:
-        if document_id not in self.active_connections:
-            return set()
-        return set(self.active_connections[document_id].keys())
+        # 只包含本进程的连接
+        return {connection.user_id for connection in self.active_connections.get(document_id, {}).values()}
 
 
 manager = ConnectionManager()
-
@@ -0,0 +1,72 @@
+import asyncio
+import uuid
+from typing import Any, Dict, Optional, Set
+from app.config import settings
+from app.websocket.manager import ConnectionManager, manager
+
+
+class PresenceHub:
+    # 光标与在线状态不逐条转发：服务端按文档、按用户只保留最新状态，
+    # 每隔 PRESENCE_TICK_INTERVAL 秒把有变化的文档的完整状态合并成一帧广播，流量只与用户数和频率有关。
+    # 每帧携带本进程的 source 标识（多 worker 时客户端按 source 分别替换），发送队列中未发出的旧帧会被新帧覆盖
+    def __init__(self, connections: ConnectionManager):
+        self.connections = connections
+        self.source = uuid.uuid4().hex[:12]
+        self._states: Dict[int, Dict[int, Dict[str, Any]]] = {}
+        self._dirty: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def join(self, document_id: int, user_id: int):
+        self._states.setdefault(document_id, {})[user_id] = {"user_id": user_id, "status": "active"}
+        self._dirty.add(document_id)
+
+    def update(self, document_id: int, user_id: int, fields: Dict[str, Any]):
+        state = self._states.setdefault(document_id, {}).setdefault(user_id, {"user_id": user_id, "status": "active"})
+        state.update(fields)
+        self._dirty.add(document_id)
+
+    def leave(self, document_id: int, user_id: int):
+        states = self._states.get(document_id)
+        if states is None or states.pop(user_id, None) is None:
+            return
+        # 最后一个用户离开后仍需广播一次空状态，文档的记录在 flush 时清理
+        self._dirty.add(document_id)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, set()
+        for document_id in dirty:
+            states = self._states.get(document_id, {})
+            # 合并键包含文档 id：一个连接订阅多个文档时，各文档积压的在线状态分别只保留最新一条
+            await self.connections.broadcast_to_document({
+                "type": "presence",
+                "data": {
+                    "document_id": document_id,
+                    "source": self.source,
+                    "users": list(states.values())
+                }
+            }, document_id, coalesce_key=f"presence:{document_id}:{self.source}")
+            if not states:
+                self._states.pop(document_id, None)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_TICK_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"广播在线状态失败: {e}")
+
+
+presence_hub = PresenceHub(manager)
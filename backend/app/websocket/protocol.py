@@ -0,0 +1,64 @@
+from typing import Any, Dict, Union
+from fastapi import WebSocket, WebSocketDisconnect
+import json
+
+try:
+    import msgpack
+except ImportError:  # 未安装时只提供 JSON
+    msgpack = None
+
+Payload = Union[str, bytes]
+
+
+class JsonCodec:
+    # 默认协议：文本帧，与 WebSocket.send_json 的序列化方式一致
+    name = "json"
+    label = "JSON"
+    binary = False  # 是否能直接携带二进制数据，否则需要 base64 编码
+
+    def encode(self, message: Dict[str, Any]) -> Payload:
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+    def decode(self, data: Payload) -> Any:
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    # 二进制帧：MessagePack 编码，整数和短字符串更紧凑，编解码开销也更低
+    name = "msgpack"
+    label = "MessagePack"
+    binary = True
+
+    def encode(self, message: Dict[str, Any]) -> Payload:
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, data: Payload) -> Any:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except Exception as e:
+            raise ValueError(str(e))
+
+
+json_codec = JsonCodec()
+CODECS = {json_codec.name: json_codec}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+
+def get_codec(name: str) -> Union[JsonCodec, MsgpackCodec]:
+    # 客户端在连接时通过 protocol 参数协商，不支持的协议回退到 JSON
+    return CODECS.get(name, json_codec)
+
+
+async def receive_message(websocket: WebSocket, codec: Union[JsonCodec, MsgpackCodec]) -> Dict[str, Any]:
+    # 文本帧和二进制帧都按协商的协议解码；格式无效时抛出 ValueError
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    data = message.get("bytes") if message.get("bytes") is not None else message.get("text")
+    decoded = codec.decode(data)
+    if not isinstance(decoded, dict):
+        raise ValueError("消息必须是对象")
+    return decoded
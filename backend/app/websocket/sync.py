@@ -0,0 +1,110 @@
+import asyncio
+import base64
+import zlib
+from collections import OrderedDict
+from typing import Dict, Tuple, Union
+from app.config import settings
+from app.websocket.protocol import JsonCodec, MsgpackCodec, Payload
+
+
+def _compress(content: str) -> Tuple[str, Union[str, bytes]]:
+    raw = content.encode("utf-8")
+    if len(raw) < settings.INITIAL_SYNC_COMPRESS_THRESHOLD:
+        return "identity", content
+    return "deflate", zlib.compress(raw, settings.INITIAL_SYNC_COMPRESSION_LEVEL)
+
+
+class _SyncEntry:
+    def __init__(self, version: int, encoding: str, data: Union[str, bytes]):
+        self.version = version
+        self.encoding = encoding
+        self.data = data
+        self.frames: Dict[str, Payload] = {}  # 协议 -> 已编码的完整消息
+
+    @property
+    def size(self) -> int:
+        return len(self.data) + sum(len(frame) for frame in self.frames.values())
+
+
+class InitialSyncCache:
+    # 订阅时可选的首次同步：一条 initial_sync 消息携带文档当前内容和版本，内容较大时用 zlib（deflate）压缩。
+    # 每个文档只缓存最新版本的压缩结果和各协议编码后的消息，热门文档的多个加入者直接复用；
+    # 同一版本并发的多个请求只压缩一次。压缩在线程池中进行，不阻塞事件循环
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[int, _SyncEntry]" = OrderedDict()
+        self._pending: Dict[Tuple[int, int], asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_message(
+        self,
+        document_id: int,
+        content: str,
+        version: int,
+        codec: Union[JsonCodec, MsgpackCodec]
+    ) -> Payload:
+        entry = self._entries.get(document_id)
+        if entry is not None and entry.version == version:
+            self.hits += 1
+            self._entries.move_to_end(document_id)
+        else:
+            entry = await self._build(document_id, content, version)
+        
+        frame = entry.frames.get(codec.name)
+        if frame is None:
+            data = entry.data
+            if isinstance(data, bytes) and not codec.binary:
+                data = base64.b64encode(data).decode("ascii")
+            frame = codec.encode({
+                "type": "initial_sync",
+                "data": {
+                    "document_id": document_id,
+                    "version": version,
+                    "encoding": entry.encoding,
+                    "content": data
+                }
+            })
+            entry.frames[codec.name] = frame
+            self._evict()
+        return frame
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": sum(entry.size for entry in self._entries.values()),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    async def _build(self, document_id: int, content: str, version: int) -> _SyncEntry:
+        key = (document_id, version)
+        future = self._pending.get(key)
+        if future is None:
+            self.misses += 1
+            future = asyncio.get_running_loop().run_in_executor(None, _compress, content)
+            self._pending[key] = future
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+        else:
+            self.hits += 1
+        encoding, data = await asyncio.shield(future)
+        
+        entry = self._entries.get(document_id)
+        if entry is None or entry.version < version:
+            entry = self._entries[document_id] = _SyncEntry(version, encoding, data)
+            self._entries.move_to_end(document_id)
+            self._evict()
+        elif entry.version > version:
+            # 已有更新版本的缓存，旧版本的结果只用于本次发送
+            return _SyncEntry(version, encoding, data)
+        return entry
+
+    def _evict(self):
+        total = sum(entry.size for entry in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            total -= entry.size
+
+
+initial_sync_cache = InitialSyncCache(settings.INITIAL_SYNC_CACHE_MAX_BYTES)
@@ -0,0 +1,209 @@
+# WebSocket 空闲连接负载检查：大量订阅了文档但不发消息的连接与 REST 请求同时运行，
+# 确认空闲连接不占用数据库连接池，REST 请求不会因为等待连接而变慢或超时。
+# 默认在本进程中用 uvicorn 启动应用（临时 SQLite 数据库，使用默认的连接池配置）；
+# 给出 --url 时只作为客户端连接已运行的服务。需要 httpx 与 websockets。
+#
+#   cd backend && python scripts/ws_load_check.py --sockets 2000 --duration 15
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import sys
+import tempfile
+import time
+from typing import List
+
+import httpx
+import websockets
+
+PASSWORD = "loadcheck123"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="WebSocket 空闲连接与 REST 请求的负载检查")
+    parser.add_argument("--url", help="已运行服务的地址，例如 http://127.0.0.1:8000；不指定时在本进程中启动应用")
+    parser.add_argument("--sockets", type=int, default=2000, help="空闲 WebSocket 连接数")
+    parser.add_argument("--duration", type=float, default=15.0, help="REST 请求持续的时间（秒）")
+    parser.add_argument("--rest-workers", type=int, default=20, help="并发发送 REST 请求的数量")
+    parser.add_argument("--connect-concurrency", type=int, default=200, help="同时进行的 WebSocket 握手数")
+    parser.add_argument("--max-p99", type=float, default=1.0, help="REST 请求 p99 延迟上限（秒），超过则检查失败")
+    return parser.parse_args()
+
+
+def raise_open_file_limit(sockets: int):
+    # 每个连接在客户端和（本进程启动时的）服务端各占一个文件描述符
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = sockets * 2 + 1024
+    if soft < wanted:
+        target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_local_server(sockets: int):
+    data_dir = tempfile.mkdtemp(prefix="sharedocs-load-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{data_dir}/sharedocs.db")
+    os.environ.setdefault("DOCUMENTS_DIR", os.path.join(data_dir, "documents"))
+    os.environ.setdefault("JOURNAL_DIR", os.path.join(data_dir, "journal"))
+    # 检查期间不触发心跳断开：客户端虽然会回复 pong，但不希望心跳影响统计
+    os.environ.setdefault("HEARTBEAT_INTERVAL", "3600")
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    import uvicorn
+    import app.models  # noqa: F401
+    from app.database import Base, engine, async_engine
+    from app.main import app
+
+    Base.metadata.create_all(bind=engine)
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", backlog=max(sockets, 2048)))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server, task, async_engine.pool
+
+
+async def login(client: httpx.AsyncClient) -> str:
+    username = f"load{int(time.time() * 1000) % 10 ** 9}"
+    await client.post("/api/auth/register", json={
+        "username": username,
+        "email": f"{username}@example.com",
+        "password": PASSWORD
+    })
+    response = await client.post("/api/auth/login", json={"username": username, "password": PASSWORD})
+    response.raise_for_status()
+    return response.json()["data"]["access_token"]
+
+
+async def hold_socket(url: str, document_id: int, ready: asyncio.Semaphore, opened: List[int], stop: asyncio.Event):
+    # 握手并订阅文档后保持空闲：只读取服务端推送的消息，并回复心跳 ping
+    async with ready:
+        websocket = await websockets.connect(url, max_queue=None, open_timeout=30)
+        await websocket.send(json.dumps({"type": "subscribe", "data": {"document_id": document_id}}))
+        while True:
+            message = json.loads(await websocket.recv())
+            if message["type"] == "subscribed":
+                break
+            if message["type"] == "error":
+                raise RuntimeError(message["data"]["message"])
+    opened[0] += 1
+
+    async def read():
+        async for raw in websocket:
+            if json.loads(raw).get("type") == "ping":
+                await websocket.send(json.dumps({"type": "pong"}))
+
+    reader = asyncio.create_task(read())
+    await stop.wait()
+    alive = not reader.done()
+    reader.cancel()
+    await websocket.close()
+    return alive
+
+
+async def rest_worker(client: httpx.AsyncClient, headers: dict, document_id: int, deadline: float,
+                      latencies: List[float], errors: List[str]):
+    paths = ["/api/documents", f"/api/documents/{document_id}", f"/api/documents/{document_id}?include_content=false"]
+    index = 0
+    while time.monotonic() < deadline:
+        path = paths[index % len(paths)]
+        index += 1
+        started = time.monotonic()
+        try:
+            response = await client.get(path, headers=headers)
+            if response.status_code != 200:
+                errors.append(f"{path}: HTTP {response.status_code}")
+        except httpx.HTTPError as e:
+            errors.append(f"{path}: {type(e).__name__}")
+        latencies.append(time.monotonic() - started)
+
+
+async def sample_pool(pool, stop: asyncio.Event, peak: List[int]):
+    while not stop.is_set():
+        peak[0] = max(peak[0], pool.checkedout())
+        await asyncio.sleep(0.05)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+async def main() -> int:
+    args = parse_args()
+    raise_open_file_limit(args.sockets)
+
+    server = server_task = pool = None
+    base_url = args.url
+    if base_url is None:
+        base_url, server, server_task, pool = await start_local_server(args.sockets)
+    ws_base = base_url.replace("http", "ws", 1)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=10.0, limits=httpx.Limits(max_connections=args.rest_workers)) as client:
+        token = await login(client)
+        headers = {"Authorization": f"Bearer {token}"}
+        response = await client.post("/api/documents", json={"title": "负载检查", "content": "hello"}, headers=headers)
+        document_id = response.json()["data"]["id"]
+
+        stop = asyncio.Event()
+        opened = [0]
+        ready = asyncio.Semaphore(args.connect_concurrency)
+        started = time.monotonic()
+        holders = [
+            asyncio.create_task(hold_socket(f"{ws_base}/ws?token={token}", document_id, ready, opened, stop))
+            for _ in range(args.sockets)
+        ]
+        while opened[0] < args.sockets and not any(holder.done() for holder in holders):
+            await asyncio.sleep(0.1)
+        failed_handshakes = [holder for holder in holders if holder.done() and holder.exception() is not None]
+        print(f"已建立 {opened[0]}/{args.sockets} 个空闲连接，用时 {time.monotonic() - started:.1f}s")
+        if failed_handshakes:
+            print(f"握手失败: {failed_handshakes[0].exception()!r}")
+
+        peak = [0]
+        sampler = asyncio.create_task(sample_pool(pool, stop, peak)) if pool is not None else None
+        idle_checkedout = pool.checkedout() if pool is not None else None
+
+        latencies: List[float] = []
+        errors: List[str] = []
+        deadline = time.monotonic() + args.duration
+        await asyncio.gather(*(
+            rest_worker(client, headers, document_id, deadline, latencies, errors)
+            for _ in range(args.rest_workers)
+        ))
+
+        stop.set()
+        if sampler is not None:
+            await sampler
+        results = await asyncio.gather(*holders, return_exceptions=True)
+        alive = sum(1 for result in results if result is True)
+
+    p50, p99 = percentile(latencies, 0.5), percentile(latencies, 0.99)
+    print(f"REST 请求 {len(latencies)} 个（{len(latencies) / args.duration:.0f}/s），失败 {len(errors)} 个，"
+          f"p50 {p50 * 1000:.1f}ms，p99 {p99 * 1000:.1f}ms")
+    print(f"检查结束时仍然存活的连接 {alive}/{args.sockets}")
+    if pool is not None:
+        print(f"连接池：空闲连接建立后借出 {idle_checkedout} 个，REST 期间峰值 {peak[0]} 个（{pool.status()}）")
+    if errors:
+        print(f"失败示例: {errors[:5]}")
+
+    if server is not None:
+        server.should_exit = True
+        await server_task
+
+    ok = alive == args.sockets and not errors and p99 <= args.max_p99 and not idle_checkedout
+    print("通过" if ok else "未通过")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,45 @@
+import itertools
+import os
+import tempfile
+
+import pytest
+
+# 在导入应用之前指定临时的 SQLite 数据库与存储目录
+_data_dir = tempfile.mkdtemp(prefix="sharedocs-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_data_dir}/sharedocs.db"
+os.environ["DOCUMENTS_DIR"] = os.path.join(_data_dir, "documents")
+os.environ["JOURNAL_DIR"] = os.path.join(_data_dir, "journal")
+os.environ["BACKPLANE_SOCKET_DIR"] = os.path.join(_data_dir, "backplane")
+
+from fastapi.testclient import TestClient  # noqa: E402
+import app.models  # noqa: E402,F401
+from app.database import Base, engine  # noqa: E402
+from app.main import app  # noqa: E402
+
+_user_ids = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    Base.metadata.create_all(bind=engine)
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def make_user(client):
+    def make():
+        username = f"user{next(_user_ids)}"
+        client.post("/api/auth/register", json={
+            "username": username,
+            "email": f"{username}@example.com",
+            "password": "secret123"
+        })
+        response = client.post("/api/auth/login", json={"username": username, "password": "secret123"})
+        return {"Authorization": f"Bearer {response.json()['data']['access_token']}"}
+    return make
+
+
+@pytest.fixture
+def auth_headers(make_user):
+    return make_user()
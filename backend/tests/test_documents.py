@@ -0,0 +1,34 @@
+def test_cursor_pagination_visits_every_document_once(client, auth_headers):
+    # 同一秒内创建的文档 updated_at 相同，翻页依赖 (updated_at, id) 的比较
+    created = [
+        client.post("/api/documents", json={"title": f"分页 {i}", "content": ""}, headers=auth_headers).json()["data"]["id"]
+        for i in range(5)
+    ]
+
+    seen = []
+    cursor = None
+    for _ in range(len(created)):
+        params = {"page_size": 2, "include_total": "false"}
+        if cursor:
+            params["cursor"] = cursor
+        data = client.get("/api/documents", params=params, headers=auth_headers).json()["data"]
+        seen += [item["id"] for item in data["items"]]
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+
+    assert cursor is None
+    assert seen == sorted(created, reverse=True)
+
+    # 游标分页与按页码分页的顺序一致
+    by_page = []
+    for page in (1, 2, 3):
+        data = client.get("/api/documents", params={"page": page, "page_size": 2}, headers=auth_headers).json()["data"]
+        by_page += [item["id"] for item in data["items"]]
+    assert by_page == seen
+    assert data["total"] == 5
+
+
+def test_invalid_cursor_is_rejected(client, auth_headers):
+    response = client.get("/api/documents", params={"cursor": "not-a-cursor"}, headers=auth_headers)
+    assert response.status_code == 400
@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app.database import SessionLocal
+from app.models.document_operation import DocumentOperation
+
+
+def test_concurrent_edits_are_rebased(client, auth_headers):
+    response = client.post("/api/documents", json={"title": "并发编辑", "content": "hello"}, headers=auth_headers)
+    document_id = response.json()["data"]["id"]
+
+    def insert(text):
+        return client.post(f"/api/documents/{document_id}/operations", json={
+            "type": "insert", "from_pos": 0, "to_pos": 0, "content": text, "base_version": 0
+        }, headers=auth_headers).json()
+
+    # 五个请求都基于版本 0，由 actor 依次变换后应用，各自得到不同的新版本
+    with ThreadPoolExecutor(5) as executor:
+        results = list(executor.map(insert, "abcde"))
+
+    assert all(result["success"] for result in results)
+    assert sorted(result["data"]["version"] for result in results) == [1, 2, 3, 4, 5]
+
+    document = client.get(f"/api/documents/{document_id}", headers=auth_headers).json()["data"]
+    assert document["current_version"] == 5
+    assert sorted(document["content"][:5]) == list("abcde")
+    assert document["content"][5:] == "hello"
+
+    # 操作记录的版本连续，从初始内容依次重放后与当前内容一致
+    with SessionLocal() as db:
+        rows = db.query(DocumentOperation).filter(
+            DocumentOperation.document_id == document_id
+        ).order_by(DocumentOperation.version_before).all()
+    assert [(row.version_before, row.version_after) for row in rows] == [(v, v + 1) for v in range(5)]
+    content = "hello"
+    for row in rows:
+        operation = row.operation_data
+        content = content[:operation["from_pos"]] + operation["content"] + content[operation["to_pos"]:]
+    assert content == document["content"]
+
+
+def test_edit_is_rebased_when_another_worker_commits_first(client, auth_headers, monkeypatch):
+    from app.models.document import Document
+    from app.storage import write_behind as write_behind_module
+    from app.storage.backends import storage_backend
+
+    document_id = client.post("/api/documents", json={"title": "多进程", "content": "hello"}, headers=auth_headers).json()["data"]["id"]
+    user_id = client.get("/api/auth/me", headers=auth_headers).json()["data"]["id"]
+    stage = write_behind_module.stage_document_content
+    raced = []
+
+    def stage_after_other_worker(staged_id, content, version, fsync):
+        # 模拟另一个 worker 在本次提交之前提交了版本 1：在开头插入 ">"
+        if not raced:
+            raced.append(version)
+            record = write_behind_module.build_operation_record(document_id, user_id, {
+                "type": "insert", "from_pos": 0, "to_pos": 0, "content": ">", "marks": None, "base_version": 0
+            }, 0)
+            with SessionLocal() as db:
+                db.add_all(write_behind_module.build_operation_rows([record]))
+                db.query(Document).filter(Document.id == document_id).update({"current_version": 1})
+                db.commit()
+            storage_backend.write(document_id, ">hello")
+        stage(staged_id, content, version, fsync)
+
+    monkeypatch.setattr(write_behind_module, "stage_document_content", stage_after_other_worker)
+    result = client.post(f"/api/documents/{document_id}/operations", json={
+        "type": "insert", "from_pos": 5, "to_pos": 5, "content": "!", "base_version": 0
+    }, headers=auth_headers).json()
+
+    # 第一次提交因版本已变化失败，重试时补齐版本 1 并变换后提交为版本 2
+    assert raced == [1]
+    assert result["success"] and result["data"]["version"] == 2
+    document = client.get(f"/api/documents/{document_id}", headers=auth_headers).json()["data"]
+    assert document["current_version"] == 2
+    assert document["content"] == ">hello!"
+    with SessionLocal() as db:
+        rows = db.query(DocumentOperation).filter(
+            DocumentOperation.document_id == document_id
+        ).order_by(DocumentOperation.version_before).all()
+    assert [(row.version_before, row.version_after) for row in rows] == [(0, 1), (1, 2)]
@@ -0,0 +1,104 @@
+import random
+
+import pytest
+
+from app.utils.operation import apply_operation, format_selection
+from app.utils.ot import format_edits, rebase_operations, transform_sequences
+
+
+def record(content, operation):
+    # 与 apply_operations 一样给格式化操作记录实际做出的修改
+    if operation["type"] == "format":
+        from_pos = operation["from_pos"]
+        _, edits = format_selection(content[from_pos:operation["to_pos"]], operation["marks"])
+        operation = {**operation, "edits": [[from_pos + start, from_pos + stop, text] for start, stop, text in edits]}
+    return operation
+
+
+def random_operation(rng, content, removal):
+    # removal 为 False 时格式化只加标记
+    length = len(content)
+    op_type = rng.choice(["insert", "delete", "replace", "format"])
+    if op_type == "insert" or length == 0:
+        pos = rng.randint(0, length)
+        return {"type": "insert", "from_pos": pos, "to_pos": pos, "content": rng.choice("XYZ") * rng.randint(1, 3)}
+    from_pos = rng.randint(0, length - 1)
+    to_pos = rng.randint(from_pos + 1, length)
+    if op_type == "delete":
+        return {"type": "delete", "from_pos": from_pos, "to_pos": to_pos}
+    if op_type == "replace":
+        return {"type": "replace", "from_pos": from_pos, "to_pos": to_pos, "content": rng.choice("PQ") * rng.randint(1, 3)}
+    marks = {mark: not removal or rng.random() < 0.6 for mark in ("bold", "italic", "code") if rng.random() < 0.5}
+    return {"type": "format", "from_pos": from_pos, "to_pos": to_pos, "marks": marks or {"bold": True}}
+
+
+def random_sequence(rng, content, removal):
+    operations = []
+    for _ in range(rng.randint(1, 4)):
+        operation = record(content, random_operation(rng, content, removal))
+        content = apply_operation(content, operation)
+        operations.append(operation)
+    return operations, content
+
+
+def apply_all(content, operations):
+    for operation in operations:
+        content = apply_operation(content, operation)
+    return content
+
+
+def random_text(rng):
+    return "".join(rng.choice("ab*`") for _ in range(rng.randint(0, 10)))
+
+
+def is_removal(operation):
+    return operation["type"] == "format" and not all(operation["marks"].values())
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_transform_sequences_converge(seed):
+    # 两组基于同一版本的操作按两种顺序应用后结果一致；已应用的一侧可以去除格式（按记录的修改展开）
+    rng = random.Random(seed)
+    for _ in range(2000):
+        content = random_text(rng)
+        operations, after_operations = random_sequence(rng, content, removal=False)
+        applied, after_applied = random_sequence(rng, content, removal=True)
+        expanded = [edit for operation in applied for edit in (format_edits(operation) if is_removal(operation) else [operation])]
+
+        transformed, applied_after = transform_sequences(operations, expanded)
+
+        assert apply_all(after_applied, transformed) == apply_all(after_operations, applied_after)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_rebase_is_valid_or_rejected(seed):
+    # 变换结果总能应用；只有新操作中去除格式的操作之后还有其他操作时才拒绝
+    rng = random.Random(seed)
+    for _ in range(2000):
+        content = random_text(rng)
+        operations, _ = random_sequence(rng, content, removal=True)
+        operations = [{key: value for key, value in operation.items() if key != "edits"} for operation in operations]
+        history, current = random_sequence(rng, content, removal=True)
+        try:
+            rebased = rebase_operations(operations, history)
+        except ValueError:
+            assert any(is_removal(operation) for operation in operations[:-1])
+            continue
+        apply_all(current, rebased)
+
+
+def test_rebase_across_format_keeps_markers():
+    content = "abcdefgh"
+    history = [record(content, {"type": "delete", "from_pos": 3, "to_pos": 5})]
+    history.append(record(apply_all(content, history), {"type": "format", "from_pos": 0, "to_pos": 4, "marks": {"bold": True}}))
+
+    rebased = rebase_operations([{"type": "delete", "from_pos": 2, "to_pos": 7}], history)
+
+    assert apply_all(apply_all(content, history), rebased) == "**ab**h"
+
+
+def test_rebase_rejects_removal_format_without_edits():
+    history = [{"type": "format", "from_pos": 0, "to_pos": 4, "marks": {"bold": False}}]
+
+    with pytest.raises(ValueError):
+        rebase_operations([{"type": "insert", "from_pos": 1, "to_pos": 1, "content": "x"}], history)
@@ -0,0 +1,51 @@
+import random
+import re
+
+import pytest
+
+from app.utils import rope as rope_module
+from app.utils.operation import apply_operation
+from app.utils.rope import Rope
+
+
+@pytest.fixture(params=[False, True], ids=["default", "small-chunks"])
+def chunked(request, monkeypatch):
+    # 调小叶子节点和重建阈值，让少量编辑也能触发节点拆分与整体重建
+    if request.param:
+        monkeypatch.setattr(rope_module, "MAX_CHUNK_SIZE", 8)
+        monkeypatch.setattr(rope_module, "REBUILD_SLACK", 4)
+
+
+def random_operation(rng, length):
+    # 位置可能越界，校验错误也要与字符串一致
+    op_type = rng.choice(["insert", "delete", "replace", "format"])
+    from_pos = rng.randint(0, length + 1)
+    to_pos = from_pos if op_type == "insert" else rng.randint(from_pos, length + 1)
+    if op_type == "format":
+        return {"type": op_type, "from_pos": from_pos, "to_pos": to_pos,
+                "marks": rng.choice([{"bold": True}, {"italic": False}, {"code": True, "bold": False}])}
+    return {"type": op_type, "from_pos": from_pos, "to_pos": to_pos, "content": rng.choice("xy*") * rng.randint(0, 12)}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_rope_matches_string(chunked, seed):
+    rng = random.Random(seed)
+    for _ in range(50):
+        text = "".join(rng.choice("ab*`c ") for _ in range(rng.randint(0, 60)))
+        rope = Rope(text)
+        for _ in range(100):
+            operation = random_operation(rng, len(text))
+            try:
+                expected = apply_operation(text, operation)
+            except ValueError as e:
+                with pytest.raises(ValueError, match=re.escape(str(e))):
+                    apply_operation(rope, operation)
+            else:
+                assert apply_operation(rope, operation) is rope
+                text = expected
+
+            assert len(rope) == len(text)
+            start = rng.randint(0, len(text))
+            stop = rng.randint(start, len(text))
+            assert rope[start:stop] == text[start:stop]
+        assert str(rope) == text
@@ -0,0 +1,56 @@
+def _receive(websocket, message_type):
+    # 跳过在线状态等无关消息
+    while True:
+        message = websocket.receive_json()
+        if message["type"] == message_type:
+            return message
+
+
+def _user_id(client, headers):
+    return client.get("/api/auth/me", headers=headers).json()["data"]["id"]
+
+
+def test_unshare_revokes_websocket_edits(client, auth_headers, make_user):
+    editor_headers = make_user()
+    editor_token = editor_headers["Authorization"].split()[1]
+    document_id = client.post("/api/documents", json={"title": "分享", "content": "hello"}, headers=auth_headers).json()["data"]["id"]
+    share = client.post(f"/api/documents/{document_id}/shares", json={
+        "user_id": _user_id(client, editor_headers), "permission": "edit"
+    }, headers=auth_headers).json()["data"]
+
+    with client.websocket_connect(f"/ws?token={editor_token}") as websocket:
+        _receive(websocket, "connected")
+        websocket.send_json({"type": "subscribe", "data": {"document_id": document_id}})
+        assert _receive(websocket, "subscribed")["data"]["can_edit"] is True
+
+        client.delete(f"/api/documents/{document_id}/shares/{share['id']}", headers=auth_headers)
+        assert _receive(websocket, "access_revoked")["data"]["document_id"] == document_id
+
+        # 连接已被退订，之后的操作不会被应用
+        websocket.send_json({"type": "operation", "document_id": document_id, "id": 1, "data": {
+            "type": "insert", "from_pos": 0, "to_pos": 0, "content": "EVIL", "base_version": 0
+        }})
+        assert _receive(websocket, "error")["data"]["message"] == f"未订阅文档 {document_id}"
+
+    content = client.get(f"/api/documents/{document_id}", headers=auth_headers).json()["data"]["content"]
+    assert content == "hello"
+
+
+def test_websocket_edits_recheck_permission(client, auth_headers, make_user):
+    editor_headers = make_user()
+    editor_token = editor_headers["Authorization"].split()[1]
+    document_id = client.post("/api/documents", json={"title": "降级", "content": "hello"}, headers=auth_headers).json()["data"]["id"]
+    editor_id = _user_id(client, editor_headers)
+    client.post(f"/api/documents/{document_id}/shares", json={"user_id": editor_id, "permission": "edit"}, headers=auth_headers)
+
+    with client.websocket_connect(f"/ws?token={editor_token}&document_id={document_id}") as websocket:
+        _receive(websocket, "subscribed")
+        # 订阅之后降为只读
+        client.post(f"/api/documents/{document_id}/shares", json={"user_id": editor_id, "permission": "read"}, headers=auth_headers)
+        websocket.send_json({"type": "operation", "id": 1, "data": {
+            "type": "insert", "from_pos": 0, "to_pos": 0, "content": "EVIL", "base_version": 0
+        }})
+        assert _receive(websocket, "operation_error")["data"]["status"] == 403
+
+    content = client.get(f"/api/documents/{document_id}", headers=auth_headers).json()["data"]["content"]
+    assert content == "hello"
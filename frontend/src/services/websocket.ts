@@ -103,6 +103,11 @@ export class DocumentWebSocket {
   }
 
   private handleMessage(message: WebSocketMessage) {
+    // 服务端心跳：长时间不响应的连接会被断开
+    if (message.type === 'ping') {
+      this.send({ type: 'pong' })
+      return
+    }
     const handler = this.messageHandlers.get(message.type)
     if (handler) {
       handler(message.data)